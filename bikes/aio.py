@@ -0,0 +1,276 @@
+'''
+asyncio version of the bikes query API, over a small stdlib HTTP/1.1 client with a keep-alive pool.
+
+    import asyncio, aio
+    asyncio.get_event_loop().run_until_complete(
+      aio.find_nearby_stations(51.51, -0.03)
+    )
+'''
+import asyncio
+import gzip
+import json
+import ssl
+import zlib
+try:
+  from urllib.parse import urlsplit
+except ImportError:
+  from urlparse import urlsplit
+
+from snapshot import SnapshotStore
+from station import normalize, bikes_and_spaces
+from stationindex import StationIndex
+from tflclient import BASE_URL
+
+
+class HTTPError(IOError):
+  def __init__(self, url, status):
+    IOError.__init__(self, '%s returned %s' % (url, status))
+    self.status = status
+
+
+class Response(object):
+  def __init__(self, status, headers, body):
+    self.status_code = status
+    self.headers = headers
+    self.content = body
+
+  def json(self):
+    return json.loads(self.content.decode('utf-8'))
+
+
+class AsyncTflClient(object):
+  '''Keep-alive HTTP/1.1 GETs against one host. At most pool_size requests are in flight at once; idle connections are reused.'''
+  RETRY_STATUS = (429, 500, 502, 503, 504)
+
+  def __init__(self, base_url=BASE_URL, timeout=10, retries=2, backoff=0.1, pool_size=8):
+    parts = urlsplit(base_url)
+    self.base_url = base_url.rstrip('/')
+    self.host = parts.hostname
+    self.https = parts.scheme == 'https'
+    self.port = parts.port or (443 if self.https else 80)
+    self.timeout = timeout
+    self.retries = retries
+    self.backoff = backoff
+    self.pool_size = pool_size
+    self._ssl = ssl.create_default_context() if self.https else None
+    self._loop = None
+    self._idle = []
+    self._sem = None
+
+  def url(self, path):
+    return self.base_url + '/' + path.lstrip('/')
+
+  def _bind(self):
+    # connections and semaphores belong to one loop; start over if we're on a new one
+    loop = asyncio.get_event_loop()
+    if loop is not self._loop:
+      # the old loop is usually closed by now, so writer.close() would raise
+      for reader, writer in self._idle:
+        try:
+          writer.transport.abort()
+        except RuntimeError:
+          pass
+      self._idle = []
+      self._sem = asyncio.Semaphore(self.pool_size)
+      self._loop = loop
+
+  async def _connect(self):
+    return await asyncio.open_connection(
+      self.host, self.port, ssl=self._ssl
+    )
+
+  async def _read_body(self, reader, headers):
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+      parts = []
+      while True:
+        size = int((await reader.readline()).split(b';')[0], 16)
+        if size == 0:
+          # trailers, then the blank line
+          while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+          break
+        parts.append(await reader.readexactly(size))
+        await reader.readline()
+      return b''.join(parts)
+    if 'content-length' in headers:
+      return await reader.readexactly(int(headers['content-length']))
+    return await reader.read()
+
+  async def _once(self, path, headers):
+    conn = self._idle.pop() if self._idle else None
+    fresh = conn is None
+    if fresh:
+      conn = await self._connect()
+    reader, writer = conn
+    lines = [
+      'GET /%s HTTP/1.1' % path.lstrip('/'),
+      'Host: %s' % self.host,
+      'Accept: application/json',
+      'Accept-Encoding: gzip, deflate',
+      'Cache-Control: no-cache',
+      'Connection: keep-alive',
+    ]
+    for k, v in (headers or {}).items():
+      lines.append('%s: %s' % (k, v))
+    try:
+      writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+      await writer.drain()
+      status_line = await reader.readline()
+      if not status_line:
+        raise ConnectionError('connection closed')
+      status = int(status_line.split()[1])
+      resp_headers = {}
+      while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+          break
+        k, _, v = line.decode('latin-1').partition(':')
+        resp_headers[k.strip().lower()] = v.strip()
+      if status in (204, 304):
+        body = b''
+      else:
+        body = await self._read_body(reader, resp_headers)
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+      writer.close()
+      if not fresh:
+        # the server dropped an idle connection; try once on a new one
+        return await self._once(path, headers)
+      raise
+    except BaseException:
+      writer.close()
+      raise
+    framed = (
+      'content-length' in resp_headers
+      or resp_headers.get('transfer-encoding', '').lower() == 'chunked'
+      or status in (204, 304)
+    )
+    if framed and resp_headers.get('connection', '').lower() != 'close':
+      self._idle.append(conn)
+    else:
+      writer.close()
+    encoding = resp_headers.get('content-encoding', '').lower()
+    if encoding == 'gzip':
+      body = gzip.decompress(body)
+    elif encoding == 'deflate':
+      body = zlib.decompress(body)
+    return Response(status, {
+      'ETag': resp_headers.get('etag'),
+      'Last-Modified': resp_headers.get('last-modified'),
+    }, body)
+
+  async def get(self, path, headers=None, timeout=None):
+    '''GET a path, retrying connection errors, timeouts and 429/5xx with backoff'''
+    self._bind()
+    if timeout is None:
+      timeout = self.timeout
+    attempt = 0
+    while True:
+      try:
+        async with self._sem:
+          r = await asyncio.wait_for(
+            self._once(path, headers), timeout
+          )
+        if r.status_code not in self.RETRY_STATUS or attempt >= self.retries:
+          return r
+      except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+        if attempt >= self.retries:
+          raise
+      await asyncio.sleep(self.backoff * (2 ** attempt))
+      attempt += 1
+
+  async def place(self, sid, timeout=None):
+    r = await self.get('/Place/' + sid, timeout=timeout)
+    if r.status_code != 200:
+      raise HTTPError(self.url('/Place/' + sid), r.status_code)
+    return r.json()
+
+  def close(self):
+    for reader, writer in self._idle:
+      writer.close()
+    self._idle = []
+
+
+class AsyncFeedCache(SnapshotStore):
+  '''The asyncio counterpart of snapshot.FeedCache, sharing its snapshot handling and stats; concurrent callers await one fetch'''
+  def __init__(self, client, path='/BikePoint', ttl=30):
+    SnapshotStore.__init__(self, ttl)
+    self.client = client
+    self.path = path
+    self._flight = None
+
+  async def get(self, max_age=None):
+    if max_age is None:
+      max_age = self.ttl
+    snap = self.snapshot
+    if snap is not None and snap.age() <= max_age:
+      self._count('hits')
+      return snap
+    if self._flight is not None:
+      self._count('shared')
+      return await asyncio.shield(self._flight)
+    self._count('misses')
+    self._flight = asyncio.ensure_future(self._refresh(snap))
+    try:
+      return await asyncio.shield(self._flight)
+    except Exception:
+      self._count('errors')
+      raise
+
+  async def _refresh(self, snap):
+    try:
+      r = await self.client.get(self.path, self._headers(snap))
+      return self._accept(snap, r)
+    finally:
+      self._flight = None
+
+  def _bad_status(self, status):
+    raise HTTPError(self.client.url(self.path), status)
+
+  async def derive(self, name, build, max_age=None):
+    return self._memo(name, await self.get(max_age), build)
+
+
+# Shared by every coroutine in the process.
+client = AsyncTflClient()
+feed = AsyncFeedCache(client)
+
+
+async def get_bike_data(max_age=None):
+  '''Raw BikePoint records from the shared snapshot'''
+  return (await feed.get(max_age)).data
+
+
+async def get_stations(max_age=None):
+  return await feed.derive('stations', normalize, max_age)
+
+
+async def get_station_index(max_age=None):
+  stations = await get_stations(max_age)
+  return await feed.derive(
+    'index',
+    lambda data: StationIndex.from_stations(stations),
+    max_age
+  )
+
+
+async def get_bikes_and_spaces(sid, timeout=None):
+  return bikes_and_spaces(
+    await client.place(sid, timeout=timeout)
+  )
+
+
+async def get_many_bikes_and_spaces(ids, timeout=5):
+  '''[(id, (bikes, spaces) or None)] in the order of ids, fetched concurrently'''
+  async def one(sid):
+    try:
+      return await get_bikes_and_spaces(sid, timeout)
+    except Exception:
+      return None
+  results = await asyncio.gather(*[one(sid) for sid in ids])
+  return list(zip(ids, results))
+
+
+async def find_nearby_stations(lat, lon, dist=0.007, looking_for='NbEmptyDocks'):
+  '''Same as bikes.find_nearby_stations, but the position has to be given'''
+  index = await get_station_index()
+  return index.nearby(lat, lon, dist, looking_for)
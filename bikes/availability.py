@@ -0,0 +1,83 @@
+'''
+Chooses between per-station /Place calls and one filtered /BikePoint snapshot by their measured costs.
+'''
+import math
+import threading
+import time
+
+
+class AvailabilityPlanner(object):
+  '''single(ids) and bulk(ids) both return {id: (bikes, spaces) or None}. bulk_fresh() says whether a bulk fetch would be served from an already fresh snapshot (and so costs next to nothing).
+
+  single_cost and bulk_cost are the starting guesses, in seconds, for one /Place call and one full /BikePoint fetch.
+  '''
+  def __init__(self, single, bulk, bulk_fresh, workers=4, single_cost=0.25, bulk_cost=1.5, alpha=0.3):
+    self.single = single
+    self.bulk = bulk
+    self.bulk_fresh = bulk_fresh
+    self.workers = workers
+    self.alpha = alpha
+    self.cost = {
+      'single': single_cost,
+      'bulk': bulk_cost,
+    }
+    self._lock = threading.Lock()
+    self._stats = {
+      'single': {'calls': 0, 'ids': 0, 'seconds': 0.0},
+      'bulk': {'calls': 0, 'ids': 0, 'seconds': 0.0},
+    }
+    self.last = None
+
+  def estimate(self, strategy, n):
+    '''Expected seconds to fetch n stations with strategy'''
+    if strategy == 'single':
+      return self.cost['single'] * math.ceil(n / float(self.workers))
+    if self.bulk_fresh():
+      return 0.0
+    return self.cost['bulk']
+
+  def choose(self, n):
+    if self.estimate('bulk', n) <= self.estimate('single', n):
+      return 'bulk'
+    return 'single'
+
+  def get(self, ids):
+    ids = list(ids)
+    if not ids:
+      return {}
+    strategy = self.choose(len(ids))
+    fresh = strategy == 'bulk' and self.bulk_fresh()
+    t = time.time()
+    result = (self.bulk if strategy == 'bulk' else self.single)(ids)
+    elapsed = time.time() - t
+    with self._lock:
+      s = self._stats[strategy]
+      s['calls'] += 1
+      s['ids'] += len(ids)
+      s['seconds'] += elapsed
+      # what one call costs: a /Place round trip, or a full /BikePoint download
+      if strategy == 'single':
+        per = elapsed / math.ceil(len(ids) / float(self.workers))
+      else:
+        per = None if fresh else elapsed
+      if per is not None:
+        self.cost[strategy] += self.alpha * (per - self.cost[strategy])
+      self.last = (strategy, len(ids), elapsed)
+    return result
+
+  def break_even(self):
+    '''Smallest number of stations for which a full bulk fetch beats single calls'''
+    per_batch = self.cost['single']
+    if per_batch <= 0:
+      return None
+    batches = math.ceil(self.cost['bulk'] / per_batch)
+    return max(batches - 1, 0) * self.workers + 1
+
+  def stats(self):
+    '''Per-strategy calls, ids and seconds, the current cost estimates, the break-even size and the last (strategy, n, seconds)'''
+    with self._lock:
+      s = {k: dict(v) for k, v in self._stats.items()}
+      s['cost'] = dict(self.cost)
+      s['break_even'] = self.break_even()
+      s['last'] = self.last
+    return s
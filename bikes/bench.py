@@ -0,0 +1,295 @@
+'''
+Benchmarks for the station query paths against a local stub of the TfL API, on the recorded snapshot and networks scaled up from it, each function timed two ways:
+
+  end_to_end  each call starts from an empty snapshot cache, so it pays for the download, the JSON decode and the normalization
+  isolated    the snapshot is already cached, so only the query itself is timed
+
+Reports throughput, p50/p99 latency and peak traced memory as JSON, to compare two revisions:
+
+  python bench.py --out before.json
+  ... change things ...
+  python bench.py --out after.json --compare before.json
+
+Imports bikes, so run it where bikes imports (Pythonista).
+'''
+import argparse
+import copy
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+import tracemalloc
+try:
+  from http.server import HTTPServer, BaseHTTPRequestHandler
+  from socketserver import ThreadingMixIn
+except ImportError:
+  from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+  from SocketServer import ThreadingMixIn
+
+import bikes
+from tflclient import BASE_URL
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RECORDED = os.path.join(HERE, 'data.json')
+FUNCTIONS = (
+  'get_bike_data',
+  'find_nearby_stations',
+  'get_close_stations',
+  'get_lookup_dict',
+  'get_station_by_name',
+)
+
+
+def scale_network(records, size, seed=0):
+  '''`size` stations tiled from copies of the recorded network, side by side, with fresh ids, names and counts; density matches the real feed at any size'''
+  if size <= len(records):
+    return records[:size]
+  rnd = random.Random(seed)
+  n = len(records)
+  lats = [r['lat'] for r in records]
+  lons = [r['lon'] for r in records]
+  height = max(lats) - min(lats)
+  width = max(lons) - min(lons)
+  copies = (size + n - 1) // n
+  side = int(math.ceil(copies ** 0.5))
+  out = []
+  for i in range(size):
+    src = records[i % n]
+    c = i // n
+    # tiles around the original, which stays in the middle
+    row = c // side - (side - 1) // 2
+    col = c % side - (side - 1) // 2
+    r = copy.deepcopy(src)
+    r['id'] = 'BikePoints_%d' % (i + 1)
+    r['url'] = '/Place/' + r['id']
+    r['commonName'] = '%s #%d' % (src['commonName'], c)
+    r['lat'] = src['lat'] + row * height
+    r['lon'] = src['lon'] + col * width
+    for prop in r['additionalProperties']:
+      if prop['key'] in ('NbBikes', 'NbEmptyDocks'):
+        prop['value'] = str(rnd.randint(0, 20))
+    out.append(r)
+  return out
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+
+class StubServer(object):
+  '''Serves /BikePoint and /Place/{id} for a list of records on localhost'''
+  def __init__(self, records):
+    self.body = json.dumps(records).encode('utf-8')
+    self.places = {r['id']: r for r in records}
+    self.etag = '"%x"' % (hash(self.body) & 0xffffffff)
+    stub = self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+
+      def log_message(self, *args):
+        pass
+
+      def _send(self, status, body=b'', etag=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+          self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+      def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/BikePoint':
+          if self.headers.get('If-None-Match') == stub.etag:
+            return self._send(304)
+          return self._send(200, stub.body, stub.etag)
+        if path.startswith('/Place/'):
+          r = stub.places.get(path[len('/Place/'):])
+          if r is not None:
+            return self._send(200, json.dumps(r).encode('utf-8'))
+        self._send(404)
+
+    self.httpd = _Server(('127.0.0.1', 0), Handler)
+    self.url = 'http://127.0.0.1:%d' % self.httpd.server_port
+    self.thread = threading.Thread(target=self.httpd.serve_forever)
+    self.thread.daemon = True
+
+  def __enter__(self):
+    self.thread.start()
+    return self
+
+  def __exit__(self, *exc):
+    self.httpd.shutdown()
+    self.httpd.server_close()
+
+
+def percentile(values, p):
+  '''Nearest-rank percentile of an already sorted list'''
+  if not values:
+    return None
+  k = max(0, min(len(values) - 1, int(math.ceil(p / 100.0 * len(values))) - 1))
+  return values[k]
+
+
+def make_calls(records, seed=0):
+  '''fn name -> a callable running one representative query'''
+  rnd = random.Random(seed)
+  lats = [r['lat'] for r in records]
+  lons = [r['lon'] for r in records]
+  names = [r['commonName'] for r in records]
+
+  def point():
+    return (
+      rnd.uniform(min(lats), max(lats)),
+      rnd.uniform(min(lons), max(lons))
+    )
+
+  def nearby():
+    lat, lon = point()
+    return bikes.find_nearby_stations(lat=lat, lon=lon)
+
+  def close():
+    lat, lon = point()
+    return bikes.get_close_stations(lat=lat, lon=lon)
+
+  def by_name():
+    return bikes.get_station_by_name(rnd.choice(names))
+
+  return {
+    'get_bike_data': lambda: list(bikes.get_bike_data()),
+    'find_nearby_stations': nearby,
+    'get_close_stations': close,
+    'get_lookup_dict': bikes.get_lookup_dict,
+    'get_station_by_name': by_name,
+  }
+
+
+def measure(call, iterations, cold):
+  '''Timings in seconds for `iterations` calls, and the peak traced memory of one more'''
+  times = []
+  for _ in range(iterations):
+    if cold:
+      bikes.feed.clear()
+    t = time.perf_counter()
+    call()
+    times.append(time.perf_counter() - t)
+  if cold:
+    bikes.feed.clear()
+  tracemalloc.start()
+  try:
+    call()
+    peak = tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+  return times, peak
+
+
+def run(sizes, iterations=None, functions=FUNCTIONS, log=print):
+  with open(RECORDED) as f:
+    recorded = json.load(f)
+  results = []
+  for size in sizes:
+    records = scale_network(recorded, size or len(recorded))
+    n = len(records)
+    # keep the big networks from taking all day
+    e2e = iterations or max(3, min(20, 200000 // n))
+    warm = iterations or max(20, min(500, 2000000 // n))
+    calls = make_calls(records)
+    with StubServer(records) as stub:
+      bikes.set_base_url(stub.url)
+      for name in functions:
+        for mode, cold, its in (
+            ('end_to_end', True, e2e),
+            ('isolated', False, warm)
+          ):
+          if not cold:
+            bikes.feed.ttl = 1e9
+            calls[name]()
+          times, peak = measure(calls[name], its, cold)
+          times.sort()
+          row = {
+            'stations': n,
+            'function': name,
+            'mode': mode,
+            'iterations': its,
+            'throughput': its / sum(times) if sum(times) else None,
+            'p50_ms': percentile(times, 50) * 1000,
+            'p99_ms': percentile(times, 99) * 1000,
+            'peak_kb': peak / 1024.0,
+          }
+          results.append(row)
+          log('%7d %-22s %-10s %9.1f/s p50 %9.3fms p99 %9.3fms peak %9.0fKB' % (
+            n, name, mode, row['throughput'] or 0,
+            row['p50_ms'], row['p99_ms'], row['peak_kb']
+          ))
+      bikes.feed.ttl = 30
+  bikes.set_base_url(BASE_URL)
+  return results
+
+
+def revision():
+  try:
+    return subprocess.check_output(
+      ['git', 'rev-parse', '--short', 'HEAD'],
+      cwd=HERE, stderr=subprocess.STDOUT
+    ).decode('ascii').strip()
+  except Exception:
+    return None
+
+
+def compare(results, baseline, log=print):
+  '''Print p50 and throughput of each result relative to the same row in baseline'''
+  old = {
+    (r['stations'], r['function'], r['mode']): r
+    for r in baseline['results']
+  }
+  log('vs %s:' % (baseline.get('revision') or 'baseline'))
+  for r in results:
+    o = old.get((r['stations'], r['function'], r['mode']))
+    if o is None:
+      continue
+    log('%7d %-22s %-10s p50 x%.2f throughput x%.2f' % (
+      r['stations'], r['function'], r['mode'],
+      r['p50_ms'] / o['p50_ms'] if o['p50_ms'] else 0,
+      (r['throughput'] or 0) / o['throughput'] if o['throughput'] else 0
+    ))
+
+
+def main(argv=None):
+  p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  p.add_argument('--sizes', default='0,10000,100000', help='comma separated station counts; 0 means the recorded snapshot as is')
+  p.add_argument('--iterations', type=int, default=None, help='calls per measurement (default scales with network size)')
+  p.add_argument('--functions', default=','.join(FUNCTIONS))
+  p.add_argument('--out', default=None, help='where to write the JSON results (default bench-<revision>.json)')
+  p.add_argument('--compare', default=None, help='earlier results to compare against')
+  args = p.parse_args(argv)
+  rev = revision()
+  results = run(
+    [int(s) for s in args.sizes.split(',')],
+    args.iterations,
+    args.functions.split(',')
+  )
+  report = {
+    'revision': rev,
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'timestamp': time.time(),
+    'results': results,
+  }
+  out = args.out or os.path.join(HERE, 'bench-%s.json' % (rev or 'local'))
+  with open(out, 'w') as f:
+    json.dump(report, f, indent=2)
+  print('wrote', out)
+  if args.compare:
+    with open(args.compare) as f:
+      compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+  main()
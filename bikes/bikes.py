@@ -1,12 +1,30 @@
-import requests
-import location
-from math import cos, asin, sqrt, isclose
+from math import cos, asin, sqrt
 import appex, ui, os
 import resource
 import time
 from pprint import pprint
 import json
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from itertools import islice
+from tflclient import TflClient
+from stationindex import StationIndex
+from snapshot import FeedCache
+from stationtable import StationTable
+import feedstream
+from station import Station, normalize, bikes_and_spaces
+from delta import AvailabilityTracker
+import stationcache
+import metastore
+from availability import AvailabilityPlanner
+from coalesce import Coalescer
+from scheduler import RefreshScheduler
+from locator import LocationProvider, LocationUnavailable
+from instrument import probe
+from nameindex import NameIndex
+from cluster import ClusterPyramid
+from pins import state_for
 
 
 home = [
@@ -52,31 +70,133 @@ def distance(lat1, lon1, lat2, lon2):
   a = 0.5 - cos((lat2 - lat1) * p)/2 + cos(lat1 * p) * cos(lat2 * p) * (1 - cos((lon2 - lon1) * p)) / 2
   return 12742 * asin(sqrt(a)) #2*R*asin...
 
-def get_bike_data():
-  url = 'https://api.tfl.gov.uk/BikePoint'
-  r = requests.get(
-    url,
-    headers={'Cache-Control': 'no-cache'}
-    )
-  for station in r.json():
-    yield station
+# Every request in this module goes through this client's pooled session.
+client = TflClient()
+
+# One snapshot of /BikePoint shared by everything in this module. Set feed.ttl to change how stale it may get.
+feed = FeedCache(
+  client.url('/BikePoint'),
+  client.fetch,
+  ttl=30
+)
+
+def set_base_url(url):
+  '''Point the client and the feed at another server, e.g. a local stub'''
+  client.base_url = url.rstrip('/')
+  feed.url = client.url('/BikePoint')
+  feed.clear()
+  places.invalidate()
+
+# The traced functions below report to instrument.probe once it's enabled, e.g. probe.enable(instrument.LogExporter(), instrument.RingBuffer()).
+@probe.traced('get_bike_data')
+def get_bike_data(max_age=None):
+  # an iterator rather than a generator, so the fetch happens (and is timed) in the call
+  return iter(feed.get(max_age).data)
+
+def stream_bike_data(chunk_size=16384, timeout=10):
+  '''Stations parsed off the wire as they arrive, bypassing the snapshot'''
+  r = client.get(
+    feed.url,
+    stream=True,
+    timeout=timeout
+  )
+  try:
+    for station in feedstream.iter_stations(
+        r.iter_content(chunk_size)
+      ):
+      yield station
+  finally:
+    r.close()
+
+# Shared by everything that needs a position; swap locator.backend for a locator.StaticBackend off the device.
+locator = LocationProvider(max_age=30)
+
+def get_my_location(max_age=None):
+  '''(lat, lon) of the current fix; raises LocationUnavailable if there has never been one'''
+  fix = locator.get(max_age)
+  if fix is None:
+    raise LocationUnavailable('no location fix yet')
+  return fix.lat,fix.lon
+
+def get_stations(max_age=None):
+  '''The current snapshot as normalized Station objects, converted once per snapshot'''
+  return feed.derive('stations', _normalize, max_age)
 
-def get_my_location():
-  location.start_updates()
-  time.sleep(0.1)
-  loc = location.get_location()
-  location.stop_updates()
-  return loc['latitude'],loc['longitude']
+def _normalize(data):
+  with probe.stage('filter'):
+    return normalize(data)
+
+# Last availability seen by refresh_availability(); subscribe to it to redraw only what changed.
+tracker = AvailabilityTracker()
+
+CACHE_DIR = os.path.join(
+  os.path.dirname(os.path.abspath(__file__)),
+  'cache'
+)
+
+def refresh_availability(max_age=None):
+  '''Refresh the snapshot; returns the tracker diff and saves changes to disk'''
+  return _track(get_stations(max_age))
+
+def remember_counts(found):
+  '''Fold {id: (bikes, spaces)} from /Place into the tracker and the disk cache; returns the diff'''
+  if not found:
+    return {}
+  if _snapshot_fresh():
+    stations = get_stations()
+  else:
+    stations = list(tracker.stations.values())
+  merged = []
+  for st in stations:
+    r = found.get(st.id)
+    if r is not None:
+      # the record's own timestamp, not the device clock, so later snapshots still compare
+      record = places.peek(st.id)
+      modified = None
+      if record is not None:
+        modified = Station.from_record(record).modified
+      st = Station(
+        st.id, st.name, st.lat, st.lon,
+        r[0], r[1], st.docks,
+        st.locked, st.installed, st.temporary,
+        modified
+      )
+    merged.append(st)
+  return _track(merged)
+
+def _track(stations):
+  diff = tracker.update(stations)
+  if diff:
+    try:
+      stationcache.save(tracker.stations.values(), CACHE_DIR)
+    except (IOError, OSError):
+      pass
+  return diff
+
+def open_meta_store():
+  '''The shared id -> (name, lat, lon) MetaStore, written first if missing'''
+  path = os.path.join(CACHE_DIR, stationcache.META)
+  if metastore.read_crc(path) is None:
+    stationcache.save(get_stations(), CACHE_DIR)
+  return metastore.MetaStore(path)
+
+def warm_start():
+  '''Seed the tracker from the disk cache so the first render doesn't wait on the network'''
+  if tracker.stations:
+    return True
+  stations = stationcache.load(CACHE_DIR)
+  if not stations:
+    return False
+  tracker.update(stations)
+  return True
 
 def get_simple_station_data():
-  d=get_bike_data()
   stations = {}
-  for s in d:
-    n = s['commonName']
-    stations[n] = (
-      s['id'],
-      s['lat'],
-      s['lon']
+  for s in get_stations():
+    stations[s.name] = (
+      s.id,
+      s.lat,
+      s.lon
     )
   return stations
     
@@ -89,109 +209,128 @@ def write_simple_file():
       )
     )
     
+def get_station_index(data=None):
+  '''Grid index over the feed, for callers that run many proximity queries against one snapshot'''
+  if data is None:
+    return feed.derive('index', _build_index)
+  return StationIndex.from_stations(normalize(data))
+
+def get_cached_index():
+  '''Grid index over the tracker's last known stations'''
+  return StationIndex.from_stations(tracker.stations.values())
+
+def _build_index(data):
+  stations = get_stations()
+  with probe.stage('index'):
+    return StationIndex.from_stations(stations)
+
+def get_station_table(data=None):
+  '''Column store of the feed for vectorized distance and availability queries'''
+  if data is None:
+    return feed.derive(
+      'table',
+      lambda data: StationTable.from_stations(get_stations())
+    )
+  return StationTable.from_bike_data(data)
+
+def get_name_index():
+  '''Name search over the current snapshot, built once per snapshot'''
+  return feed.derive(
+    'names',
+    lambda data: NameIndex.from_stations(get_stations())
+  )
+
 def get_station_by_name(name):
-  n = name.lower()
-  for station in get_bike_data():
-    if n in station['commonName'].lower():
-      return station
+  '''The station best matching name, allowing abbreviations and typos'''
+  return get_name_index().best(name)
+
+def search_stations(query, limit=10):
+  '''Stations matching query, best first, for autocomplete'''
+  return get_name_index().search(query, limit)
 
 def get_close_stations(
     dist=0.007, # in degrees of lat/lon
     looking_for='NbEmptyDocks',
-    lat=None,lon=None
+    lat=None,lon=None,
+    index=None
   ):
-  data = get_bike_data()
+  if index is None:
+    index = get_station_index()
   if lat is None or lon is None:
     lat, lon = get_my_location()
   stations = {}
-  for station in data:
-    la = station['lat']
-    if not isclose(
-        la,
-        lat,
-        abs_tol=dist
-      ):
-      continue
-    lo = station['lon']
-    if not isclose(
-        lo,
-        lon,
-        abs_tol=dist
-      ):
-      continue
-    n = station['commonName']
-    d = {}
-    for p in (
-        'id',
-        'lat',
-        'lon'
-      ):
-      d[p]=station[p]
-    stations[n]=d
+  for station in index.box(lat, lon, dist):
+    stations[station.name] = {
+      'id': station.id,
+      'lat': station.lat,
+      'lon': station.lon
+    }
   return stations
     
+@probe.traced('find_nearby_stations')
 def find_nearby_stations(
     dist=0.007, # in degrees of lat/lon
     looking_for='NbEmptyDocks',
-    lat=None,lon=None
+    lat=None,lon=None,
+    index=None
   ):
-  data = get_bike_data()
+  if index is None:
+    index = get_station_index()
   if lat is None or lon is None:
-    lat, lon = get_my_location()
-  stations = []
-  for station in data:
-    la = station['lat']
-    if not isclose(
-        la,
-        lat,
-        abs_tol=dist
-      ):
-      continue
-    lo = station['lon']
-    if not isclose(
-        lo,
-        lon,
-        abs_tol=dist
-      ):
-      continue
-    name = station[
-      'commonName'
-    ]
-    
-    props = station[
-      'additionalProperties'
-    ]
-    for prop in props:
-      k = prop['key']
-      if k != looking_for:
-        continue
-      v = prop['value']
-      if int(v) == 0:
-        continue
-
-      a = abs(la-lat)
-      b = abs(lo-lon)
-      c = sqrt(a*a+b*b)
-      
-      d = distance(
-        lat,
-        lon,
-        la,
-        lo
-      )
-      d = int(d*1000)
-      stations.append(
-        {
-          'name': name,
-          'distance': d,
-          looking_for: v,
-        }
-      )
-  return sorted(
-    stations, 
-    key=lambda k: k['distance']
-  )
+    with probe.stage('location'):
+      lat, lon = get_my_location()
+  with probe.stage('distance'):
+    found = index.nearby(lat, lon, dist, looking_for)
+  probe.count('nearby_results', len(found))
+  return found
   
+def station_pin(station):
+  '''(lat, lon, title, subtitle, state) map pin for a Station, counts from the snapshot'''
+  b = station.bikes
+  return (
+    station.lat, station.lon,
+    '%s/%s' % (b, b + station.spaces),
+    station.name,
+    state_for(b)
+  )
+
+def get_station_pins(lat0, lon0, lat1, lon1):
+  '''{id: pin} for the stations inside a bounding box'''
+  return {
+    st.id: station_pin(st)
+    for st in get_station_index().bbox(lat0, lon0, lat1, lon1)
+  }
+
+def pin_changes(diff):
+  '''A tracker diff as MapView.update_pins changes: {id: pin or None}'''
+  return {
+    sid: station_pin(tracker.stations[sid]) if new is not None else None
+    for sid, (old, new) in diff.items()
+  }
+
+def get_cluster_pyramid():
+  '''Station clusters for every zoom level, built once per snapshot'''
+  return feed.derive(
+    'clusters',
+    lambda data: ClusterPyramid.from_stations(get_stations())
+  )
+
+def get_station_clusters(lat0, lon0, lat1, lon1):
+  '''{key: Cluster} in a bounding box, at the level suiting its span'''
+  return {
+    cl.key: cl
+    for cl in get_cluster_pyramid().clusters(lat0, lon0, lat1, lon1)
+  }
+
+def find_nearest_many(origins, k=5, looking_for='NbBikes', at_least=1, max_distance=None):
+  '''find_nearby_stations-style results for each (lat, lon) in origins'''
+  origins = list(origins)
+  return get_station_table().nearest_many(
+    [o[0] for o in origins],
+    [o[1] for o in origins],
+    k, looking_for, at_least, max_distance
+  )
+
 class BikeView(ui.View):
   def __init__(self, *args, **kwargs):
     super().__init__(self, *args, **kwargs)
@@ -237,11 +376,14 @@ class BikeView(ui.View):
     )
     self.add_subview(self.display_view)
     self.l = l = ui.ListDataSource(
-      items=['work','home']
+      items=['work','home','nearby']
     )
     self.t =t= ui.TableView()
     t.data_source=l
     self.add_subview(t)
+    self._clicked = False
+    # searches run on this thread, never on layout's
+    self.scheduler = RefreshScheduler(self.auto_search)
     
   def layout(self):
     bh = self.height/4
@@ -255,16 +397,24 @@ class BikeView(ui.View):
     self.display_view.frame = (
       0, 0, self.width, bh*3
     )
-    self.auto_search()
+    # draw whatever the last refresh found, and let the scheduler do the next one
+    if self.scheduler.latest:
+      self.display_label.text = self.scheduler.latest
+    self.scheduler.start()
+
+  def will_close(self):
+    self.scheduler.stop()
     
   def auto_search(self):
     '''if its pre-midday and i'm close to home, set 'home' and find bikes. if i'm close to work, set work and find spaces. if its past midday and i'm close to work, find bikes. if i'm close to home, find spaces. else, do nothing.
     '''
     t = 'Find Bikes'
-    global home, work
-    s = home
     dt = datetime.datetime.now()
-    athome = closer_to_home_than_work()
+    try:
+      athome = closer_to_home_than_work()
+    except LocationUnavailable:
+      self.display_label.text = 'Waiting for location...'
+      return self.display_label.text
     ismorning = (5 < dt.hour < 12)
     if athome and ismorning:
       self.desc='home, morning: bikes'
@@ -273,28 +423,32 @@ class BikeView(ui.View):
       self.desc='work, morning: spaces'
       #print('work, morning')
       t = 'Find Spaces'
-      s = work
     elif athome and (not ismorning):
       self.desc='home, evening: spaces'
       self.t.selected_row = (0, 1)
       t = 'Find Spaces'
     elif (not athome) and (not ismorning):
       self.desc='work, evening: bikes'
-      s = work
     else:
       return
     self._clicked = False
-    self.find(t,s)
+    # nearest stations to wherever we are, not a fixed list
+    return self.find(t)
 
+  @ui.in_background
   def handle_click(self, sender):
-    stats = work
     _,r = self.t.selected_row
-    if r:
-      stats=home
-    self._clicked = True
-    self.find(sender.title, stats)
+    # row 2 is the nearby search; anything else but work (including -1, no selection) is home, as before
+    stats = {0: work, 1: home, 2: None}.get(r, home)
+    def job():
+      self._clicked = True
+      return self.find(sender.title, stats)
+    # wait for a refresh that's already running rather than race it
+    self.scheduler.run(job, wait=True)
 
-  def find(self, title, stats):
+  @probe.traced('BikeView.find')
+  def find(self, title, stats=None):
+    '''Show availability for (name, id) stations, or the nearest ones with stats=None'''
     t = title
     l = {
       'Find Bikes':'NbBikes',
@@ -305,28 +459,74 @@ class BikeView(ui.View):
     #results = [t]
     if self._clicked:
       self.desc = t
-    label.text = self.desc.capitalize()
-    for name,sid in stats:
+    header = self.desc.capitalize()
+    label.text = header
+    if stats is None:
       try:
-        b,s = get_bikes_and_spaces(sid)
-      except Exception as e:
-        try:
-          time.sleep(0.1)
-          b,s = get_bikes_and_spaces(sid)
-        except Exception as e:
+        lat, lon = get_my_location()
+      except LocationUnavailable:
+        label.text += '\nWaiting for location...'
+        return label.text
+      index = None
+      if not _snapshot_fresh() and tracker.stations:
+        # rank against the disk cache and show its counts rather than wait for the whole feed
+        index = get_cached_index()
+        for d,st in islice(index.iter_nearest(lat, lon, 1000), _WORKERS):
+          if st.modified is not None:
+            label.text += '\n%s, %sm: %s/%s (cached)' % (
+              st.name,int(d),st.bikes,st.bikes+st.spaces
+            )
+      source = iter_ranked(lat, lon, index=index)
+      results = (
+        ('%s, %sm' % (st.name, int(d)), st.id, r)
+        for d,st,r in source
+      )
+    else:
+      names = {sid: name for name,sid in stats}
+      # last known counts from the disk cache until the live ones arrive
+      for name,sid in stats:
+        st = tracker.stations.get(sid)
+        if st is not None and st.modified is not None:
+          label.text += '\n%s: %s/%s (cached)' % (
+            name,st.bikes,st.bikes+st.spaces
+          )
+      source = get_many_bikes_and_spaces(
+        [sid for name,sid in stats]
+      )
+      results = (
+        (names[sid], sid, r) for sid,r in source
+      )
+    live = False
+    fetched = {}
+    try:
+      for name,sid,r in results:
+        if r is None:
           continue
-      #n = get_num(sid, term=l[t])
-      label.text += '\n%s: %s/%s' % (name,b,b+s)
-      #results.append(
-        #'%s: %s/%s' % (name,b,b+s)
-        #'<font size="13"><p>%s\n%s: <b>%s</b>/%s</p></font>' % (t,name,b,b+s)
-      #)
-      if t == 'Find Bikes':
-        n = b
-      elif t == 'Find Spaces':
-        n = s
-      if n > 5:
-        break
+        fetched[sid] = r
+        if not live:
+          label.text = header
+          live = True
+        b,s = r
+        #n = get_num(sid, term=l[t])
+        with probe.stage('ui'):
+          label.text += '\n%s: %s/%s' % (name,b,b+s)
+        probe.count('ui_updates')
+        #results.append(
+          #'%s: %s/%s' % (name,b,b+s)
+          #'<font size="13"><p>%s\n%s: <b>%s</b>/%s</p></font>' % (t,name,b,b+s)
+        #)
+        if t == 'Find Bikes':
+          n = b
+        elif t == 'Find Spaces':
+          n = s
+        if n > 5:
+          break
+    finally:
+      # cancels the stations we no longer need
+      source.close()
+      # so the next cold start has these counts
+      remember_counts(fetched)
+    return label.text
     #label.text = '\n'.join(results)
     #label.load_html('\n'.join(results))
     '''
@@ -353,82 +553,130 @@ class BikeView(ui.View):
     label.text = s
     '''
 
-def get_bikes_and_spaces(sid):
-  url = 'https://api.tfl.gov.uk/Place/'
-  url += sid #'BikePoints_480'
-  r = requests.get(
-    url,
-    headers={'Cache-Control': 'no-cache'}
-  )
+def _fetch_place(sid, timeout=None):
+  return client.place(sid, timeout=timeout)
+
+# /Place/{id} records: identical requests in flight share one fetch, and results are reused for a few seconds. places.stats() has the counters.
+places = Coalescer(_fetch_place, ttl=5)
 
-  dd = r.json()
-  p = dd.get('additionalProperties')
-  if p is None:
-    return
-  for o in p:
-    k = o['key']
-    v = o['value']
-    if k == 'NbBikes':
-      bikes = int(v)
-    if k == 'NbEmptyDocks':
-      spaces = int(v)
-  return bikes,spaces
+@probe.traced('get_bikes_and_spaces')
+def get_bikes_and_spaces(sid, timeout=None):
+  record = places.get(sid, timeout) #'BikePoints_480'
+  with probe.stage('filter'):
+    return bikes_and_spaces(record)
       
-def get_num(sid,term='NbBikes'):
-  url = 'https://api.tfl.gov.uk/Place/'
-  url += sid#'BikePoints_480'
-  r = requests.get(
-    url,
-    headers={'Cache-Control': 'no-cache'}
+# Shared by every batch so a widget refresh never opens more than this many requests at once. Retries are the client's job.
+_WORKERS = 4
+_pool = ThreadPoolExecutor(max_workers=_WORKERS)
+
+def get_many_bikes_and_spaces(ids, timeout=5):
+  '''Yield (id, (bikes, spaces) or None) in order of ids, fetched concurrently'''
+  futures = [
+    (sid, _pool.submit(
+      get_bikes_and_spaces, sid, timeout
+    ))
+    for sid in ids
+  ]
+  try:
+    for sid,f in futures:
+      try:
+        r = f.result()
+      except Exception:
+        r = None
+      yield sid,r
+  finally:
+    for sid,f in futures:
+      f.cancel()
+
+def iter_ranked(lat=None, lon=None, max_distance=1000, window=_WORKERS, timeout=5, index=None):
+  '''Yield (metres, Station, (bikes, spaces)) closest first, fetching `window` ahead'''
+  if index is None:
+    index = get_station_index()
+  if lat is None or lon is None:
+    lat, lon = get_my_location()
+  candidates = index.iter_nearest(lat, lon, max_distance)
+  pending = deque()
+  try:
+    while True:
+      for d,st in islice(candidates, window - len(pending)):
+        pending.append((d, st, _pool.submit(
+          get_bikes_and_spaces, st.id, timeout
+        )))
+      if not pending:
+        return
+      d,st,f = pending.popleft()
+      try:
+        r = f.result()
+      except Exception:
+        r = None
+      if r is not None:
+        yield d,st,r
+  finally:
+    for d,st,f in pending:
+      f.cancel()
+
+def find_ranked(looking_for='NbBikes', wanted=1, lat=None, lon=None, max_distance=1000, index=None):
+  '''iter_ranked results up to the first station with `wanted` of looking_for'''
+  k = 0 if looking_for in ('NbBikes', 'bikes') else 1
+  found = []
+  ranked = iter_ranked(lat, lon, max_distance, index=index)
+  try:
+    for hit in ranked:
+      found.append(hit)
+      if hit[2][k] >= wanted:
+        break
+  finally:
+    ranked.close()
+  return found
+
+def _bulk_availability(ids):
+  by_id = feed.derive(
+    'by_id',
+    lambda data: {s.id: s for s in get_stations()}
   )
-  d = r.json()
-  p = d['additionalProperties']
-  for o in p:
-    if o['key'] == term:#'NbEmptyDocks':
-      v = o['value']
-      return int(v)
+  found = {}
+  for sid in ids:
+    st = by_id.get(sid)
+    found[sid] = None if st is None else (st.bikes, st.spaces)
+  return found
+
+def _snapshot_fresh():
+  snap = feed.snapshot
+  return snap is not None and snap.age() <= feed.ttl
+
+# Chooses between per-station calls and one bulk snapshot; planner.stats() shows what each has cost.
+planner = AvailabilityPlanner(
+  lambda ids: dict(get_many_bikes_and_spaces(ids)),
+  _bulk_availability,
+  _snapshot_fresh,
+  workers=_WORKERS
+)
+
+def get_availability(ids):
+  '''{id: (bikes, spaces) or None}, from /Place calls or the snapshot, whichever is cheaper'''
+  return planner.get(ids)
+
+def get_num(sid,term='NbBikes'):
+  return Station.from_record(
+    places.get(sid) #'BikePoints_480'
+  ).count(term)
     
 def get_lookup_dict():
   stations = {}
-  for s in get_bike_data():
-    n = s['commonName']
-    i = s['id']
-    p = s['additionalProperties']
-    d = {}
-    d['name'] = n
-    stations[i] = d
-    for o in p:
-      v = o['value']
-      k = o['key']
-      if k=='NbBikes':
-        d['bikes'] = v
-      elif k=='NbEmptyDocks':
-        d['spaces'] = v
+  for s in get_stations():
+    stations[s.id] = {
+      'name': s.name,
+      'bikes': s.bikes,
+      'spaces': s.spaces
+    }
   return stations
   
-def get_station_ids_close_to(lat,lon):
-  data = get_bike_data()
+def get_station_ids_close_to(lat,lon,index=None):
+  if index is None:
+    index = get_station_index()
   stations = {}
-  for station in data:
-    la = station['lat']
-    if not isclose(
-        la,
-        lat,
-        abs_tol=0.004
-      ):
-      continue
-    lo = station['lon']
-    if not isclose(
-        lo,
-        lon,
-        abs_tol=0.004
-      ):
-      continue
-    name = station[
-      'commonName'
-    ]
-    i = station['id']
-    stations[name] = i
+  for station in index.box(lat, lon, 0.004):
+    stations[station.name] = station.id
   return stations
     
 def main():
@@ -436,6 +684,7 @@ def main():
   widget_name = __file__ + str(os.stat(__file__).st_mtime)
   widget_view = appex.get_widget_view()
   if widget_view is None or widget_view.name != widget_name:
+    warm_start()
     widget_view = BikeView()
     widget_view.name = widget_name
     appex.set_widget_view(widget_view)
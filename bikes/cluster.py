@@ -0,0 +1,141 @@
+'''
+Per-zoom-level clusters of the stations for the map, with centroids and summed counts.
+'''
+from math import floor, log
+
+from pins import state_for
+
+
+class Cluster(object):
+  __slots__ = ('key', 'lat', 'lon', 'count', 'bikes', 'spaces', 'docks', 'station')
+
+  def __init__(self, key):
+    self.key = key
+    self.lat = 0.0
+    self.lon = 0.0
+    self.count = 0
+    self.bikes = 0
+    self.spaces = 0
+    self.docks = 0
+    self.station = None
+
+  def _merge(self, other):
+    # lat/lon hold sums until _finish
+    self.lat += other.lat
+    self.lon += other.lon
+    self.count += other.count
+    self.bikes += other.bikes
+    self.spaces += other.spaces
+    self.docks += other.docks
+    self.station = other.station if self.count == 1 else None
+
+  def _finish(self):
+    c = Cluster(self.key)
+    c.lat = self.lat / self.count
+    c.lon = self.lon / self.count
+    c.count = self.count
+    c.bikes = self.bikes
+    c.spaces = self.spaces
+    c.docks = self.docks
+    c.station = self.station
+    if c.station is not None:
+      c.key = c.station.id
+    return c
+
+  def __eq__(self, other):
+    # what the map shows, so a viewport can tell which clusters need redrawing
+    return isinstance(other, Cluster) and self.pin() == other.pin()
+
+  def __ne__(self, other):
+    return not self == other
+
+  __hash__ = None
+
+  def pin(self):
+    '''(lat, lon, title, subtitle, state) for MapView; a lone station looks like any other station pin'''
+    b = self.bikes
+    if self.station is not None:
+      return (
+        self.lat, self.lon,
+        '%s/%s' % (b, b + self.spaces),
+        self.station.name,
+        state_for(b)
+      )
+    return (
+      self.lat, self.lon,
+      '%s/%s' % (b, b + self.spaces),
+      '%d stations, %d docks' % (self.count, self.docks),
+      'cluster'
+    )
+
+
+class ClusterPyramid(object):
+  def __init__(self, stations, finest=0.0005, levels=16):
+    '''Level levels-1 has cells of `finest` degrees (about one station each); every level above doubles the cell size'''
+    self.finest = finest
+    self.levels = []
+    sums = {}
+    for st in stations:
+      r, c = int(floor(st.lat / finest)), int(floor(st.lon / finest))
+      cl = sums.get((r, c))
+      if cl is None:
+        cl = sums[(r, c)] = Cluster(None)
+      one = Cluster(None)
+      one.lat, one.lon, one.count = st.lat, st.lon, 1
+      one.bikes, one.spaces, one.docks = st.bikes, st.spaces, st.docks
+      one.station = st
+      cl._merge(one)
+    by_level = [sums]
+    for _ in range(levels - 1):
+      parent = {}
+      for (r, c), cl in by_level[-1].items():
+        p = parent.get((r >> 1, c >> 1))
+        if p is None:
+          p = parent[(r >> 1, c >> 1)] = Cluster(None)
+        p._merge(cl)
+      by_level.append(parent)
+    by_level.reverse()
+    for z, cells in enumerate(by_level):
+      level = {}
+      for (r, c), cl in cells.items():
+        cl.key = '%d:%d:%d' % (z, r, c)
+        level[(r, c)] = cl._finish()
+      self.levels.append(level)
+
+  @classmethod
+  def from_stations(cls, stations, **kwargs):
+    return cls(stations, **kwargs)
+
+  def cell(self, level):
+    '''Cell size of a level, in degrees'''
+    return self.finest * (1 << (len(self.levels) - 1 - level))
+
+  def level_for_span(self, d_lat, d_lon, across=6):
+    '''The level with about `across` cells over the wider side of a span (an MKCoordinateSpan's deltas)'''
+    wanted = max(d_lat, d_lon) / float(across)
+    if wanted <= self.finest:
+      return len(self.levels) - 1
+    z = len(self.levels) - 1 - int(floor(log(wanted / self.finest, 2)))
+    return max(0, min(len(self.levels) - 1, z))
+
+  def clusters(self, lat0, lon0, lat1, lon1, level=None):
+    '''Clusters whose centroids lie in the bounding box, at `level` (default: the one suiting the box's own span)'''
+    if level is None:
+      level = self.level_for_span(lat1 - lat0, lon1 - lon0)
+    cells = self.levels[level]
+    size = self.cell(level)
+    r0, c0 = int(floor(lat0 / size)), int(floor(lon0 / size))
+    r1, c1 = int(floor(lat1 / size)), int(floor(lon1 / size))
+    if (r1 - r0 + 1) * (c1 - c0 + 1) > len(cells):
+      candidates = cells.values()
+    else:
+      candidates = (
+        cells[(r, c)]
+        for r in range(r0, r1 + 1)
+        for c in range(c0, c1 + 1)
+        if (r, c) in cells
+      )
+    return [
+      cl for cl in candidates
+      if lat0 <= cl.lat <= lat1 and lon0 <= cl.lon <= lon1
+    ]
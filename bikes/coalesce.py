@@ -0,0 +1,79 @@
+'''
+Shares in-flight fetches between callers asking for the same key, and keeps results for a few seconds.
+'''
+from collections import OrderedDict
+from concurrent.futures import Future
+import threading
+import time
+
+
+class Coalescer(object):
+  def __init__(self, fetch, ttl=5.0, maxsize=128):
+    '''fetch(key, *args) does the real work; args come from whichever caller ends up doing the fetch'''
+    self.fetch = fetch
+    self.ttl = ttl
+    self.maxsize = maxsize
+    self._cache = OrderedDict()
+    self._inflight = {}
+    self._lock = threading.Lock()
+    self._stats = {
+      'hits': 0,
+      'coalesced': 0,
+      'misses': 0,
+      'errors': 0,
+    }
+
+  def stats(self):
+    '''hits (fresh in the LRU), coalesced (joined an in-flight fetch), misses (fetched), errors'''
+    with self._lock:
+      s = dict(self._stats)
+      s['size'] = len(self._cache)
+      s['inflight'] = len(self._inflight)
+    return s
+
+  def invalidate(self, key=None):
+    with self._lock:
+      if key is None:
+        self._cache.clear()
+      else:
+        self._cache.pop(key, None)
+
+  def peek(self, key):
+    '''The cached value for key however old, or None; never fetches'''
+    with self._lock:
+      hit = self._cache.get(key)
+    return None if hit is None else hit[1]
+
+  def get(self, key, *args):
+    with self._lock:
+      hit = self._cache.get(key)
+      if hit is not None and time.time() - hit[0] <= self.ttl:
+        self._cache.move_to_end(key)
+        self._stats['hits'] += 1
+        return hit[1]
+      future = self._inflight.get(key)
+      if future is not None:
+        self._stats['coalesced'] += 1
+        leader = False
+      else:
+        future = self._inflight[key] = Future()
+        self._stats['misses'] += 1
+        leader = True
+    if not leader:
+      return future.result()
+    try:
+      value = self.fetch(key, *args)
+    except BaseException as e:
+      with self._lock:
+        self._stats['errors'] += 1
+        del self._inflight[key]
+      future.set_exception(e)
+      raise
+    with self._lock:
+      self._cache[key] = (time.time(), value)
+      self._cache.move_to_end(key)
+      while len(self._cache) > self.maxsize:
+        self._cache.popitem(last=False)
+      del self._inflight[key]
+    future.set_result(value)
+    return value
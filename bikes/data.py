@@ -1,4 +1,5 @@
-this='/private/var/mobile/Containers/Shared/AppGroup/06CF1B94-7C63-4D9A-86AF-FDCB2C6080B8/Pythonista3/Documents/bikes/data.json'
+import bikes
 
-with open(this,'w') as f:
-	f.write('store')
+# Prime the on-disk station cache (bikes/cache) from a fresh snapshot
+bikes.refresh_availability()
+print(len(bikes.tracker.stations), 'stations cached in', bikes.CACHE_DIR)
@@ -0,0 +1,54 @@
+'''
+Tracks the last Stations seen and reports {id: (old, new)} count changes to subscribers.
+'''
+import threading
+
+
+def counts(station):
+  return (station.bikes, station.spaces, station.docks)
+
+
+class AvailabilityTracker(object):
+  def __init__(self):
+    self.stations = {}
+    self.subscribers = []
+    self._lock = threading.Lock()
+
+  def subscribe(self, callback):
+    '''callback(diff) runs after every update that changed something'''
+    self.subscribers.append(callback)
+    return callback
+
+  def unsubscribe(self, callback):
+    if callback in self.subscribers:
+      self.subscribers.remove(callback)
+
+  def update(self, stations):
+    '''Take a fresh list of Stations and return the diff against the previous one. New stations have old=None, retired ones new=None.'''
+    diff = {}
+    with self._lock:
+      last = self.stations
+      current = {}
+      for st in stations:
+        current[st.id] = st
+        old = last.get(st.id)
+        if old is None:
+          diff[st.id] = (None, counts(st))
+          continue
+        if (
+            old.modified is not None
+            and st.modified is not None
+            and st.modified <= old.modified
+          ):
+          # nothing touched since the last snapshot
+          continue
+        if counts(old) != counts(st):
+          diff[st.id] = (counts(old), counts(st))
+      for sid, old in last.items():
+        if sid not in current:
+          diff[sid] = (counts(old), None)
+      self.stations = current
+    if diff:
+      for callback in list(self.subscribers):
+        callback(diff)
+    return diff
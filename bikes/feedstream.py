@@ -0,0 +1,71 @@
+'''
+Incremental parsing of the /BikePoint array, one station at a time as the chunks arrive.
+'''
+import codecs
+import json
+from station import Station
+
+_decoder = json.JSONDecoder()
+_WS = ' \t\r\n'
+
+
+def iter_array(chunks):
+  '''Yield the items of a top-level JSON array from an iterable of str or bytes chunks'''
+  text = codecs.getincrementaldecoder('utf-8')()
+  buf = ''
+  pos = 0
+  started = False
+  more = True
+  # after a failed attempt, wait for the unparsed tail to double before trying again, so tiny chunks don't make this quadratic
+  retry_at = 0
+  chunks = iter(chunks)
+  while True:
+    if more:
+      try:
+        chunk = next(chunks)
+      except StopIteration:
+        more = False
+        chunk = b''
+      if isinstance(chunk, bytes):
+        chunk = text.decode(chunk, final=not more)
+      # drop what's been consumed so the buffer stays around one station long
+      buf = buf[pos:] + chunk
+      pos = 0
+    while True:
+      while pos < len(buf) and buf[pos] in _WS:
+        pos += 1
+      if pos == len(buf):
+        break
+      if not started:
+        if buf[pos] != '[':
+          raise ValueError('expected a JSON array')
+        started = True
+        pos += 1
+        continue
+      if buf[pos] == ',':
+        pos += 1
+        continue
+      if buf[pos] == ']':
+        return
+      if more and len(buf) - pos < retry_at:
+        break
+      try:
+        obj, end = _decoder.raw_decode(buf, pos)
+      except ValueError:
+        # not complete yet
+        retry_at = 2 * (len(buf) - pos)
+        break
+      retry_at = 0
+      if more and end == len(buf):
+        # a number cut off by the chunk boundary still decodes ('23' of '234')
+        break
+      pos = end
+      yield obj
+    if not more:
+      raise ValueError('truncated JSON array')
+
+
+def iter_stations(chunks):
+  '''Stations from raw response chunks, one as soon as it's complete'''
+  for record in iter_array(chunks):
+    yield Station.from_record(record)
@@ -0,0 +1,243 @@
+'''
+Opt-in tracing of the hot paths: per-call timings, stages and counters, sent to pluggable exporters. Off until enable().
+'''
+from collections import deque
+import cProfile
+import io
+import json
+import logging
+import pstats
+import threading
+import time
+import tracemalloc
+
+
+class _NullStage(object):
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+
+_NULL = _NullStage()
+
+
+class _Stage(object):
+  __slots__ = ('probe', 'trace', 'name', 'start')
+
+  def __init__(self, probe, trace, name):
+    self.probe = probe
+    self.trace = trace
+    self.name = name
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    elapsed = time.perf_counter() - self.start
+    stages = self.trace['stages']
+    stages[self.name] = stages.get(self.name, 0.0) + elapsed
+    self.probe._add('stage.' + self.name, elapsed)
+    return False
+
+
+class LogExporter(object):
+  '''One line per trace: name, total time and the time in each stage'''
+  def __init__(self, logger=None, level=logging.INFO):
+    self.logger = logger or logging.getLogger('bikes')
+    self.level = level
+
+  def __call__(self, record):
+    parts = ['%s %.1fms' % (record['name'], record['duration'] * 1000)]
+    for name, t in sorted(record['stages'].items()):
+      parts.append('%s=%.1fms' % (name, t * 1000))
+    for name, n in sorted(record['counters'].items()):
+      parts.append('%s=%s' % (name, n))
+    if record.get('error'):
+      parts.append('error=%s' % record['error'])
+    if record.get('peak') is not None:
+      parts.append('peak=%dKB' % (record['peak'] // 1024))
+    self.logger.log(self.level, ' '.join(parts))
+
+
+class JsonFileExporter(object):
+  '''Appends each trace to a JSON lines file'''
+  def __init__(self, path):
+    self.path = path
+    self._lock = threading.Lock()
+
+  def __call__(self, record):
+    line = json.dumps(record, default=str)
+    with self._lock:
+      with open(self.path, 'a') as f:
+        f.write(line + '\n')
+
+
+class RingBuffer(object):
+  '''Keeps the last `size` traces in memory'''
+  def __init__(self, size=256):
+    self.records = deque(maxlen=size)
+
+  def __call__(self, record):
+    self.records.append(record)
+
+  def __iter__(self):
+    return iter(list(self.records))
+
+  def __len__(self):
+    return len(self.records)
+
+  def clear(self):
+    self.records.clear()
+
+
+class Probe(object):
+  def __init__(self):
+    self.enabled = False
+    self.profile = False
+    self.memory = False
+    self.exporters = []
+    self._local = threading.local()
+    self._lock = threading.Lock()
+    self._totals = {}
+    self._counters = {}
+
+  def enable(self, *exporters, **options):
+    '''Start tracing. exporters are callables taking a finished trace dict; options: profile=True adds a cProfile summary to each outermost trace, memory=True its tracemalloc peak'''
+    self.exporters = list(exporters)
+    self.profile = options.get('profile', False)
+    self.memory = options.get('memory', False)
+    self.enabled = True
+
+  def disable(self):
+    self.enabled = False
+
+  def reset(self):
+    with self._lock:
+      self._totals = {}
+      self._counters = {}
+
+  def stats(self):
+    '''Totals since the last reset: {'timers': {name: {'count', 'total', 'max'}}, 'counters': {name: n}}. Timers cover traced calls by name and stages as stage.<name>.'''
+    with self._lock:
+      return {
+        'timers': {
+          k: {'count': v[0], 'total': v[1], 'max': v[2]}
+          for k, v in self._totals.items()
+        },
+        'counters': dict(self._counters),
+      }
+
+  def _add(self, name, elapsed):
+    with self._lock:
+      t = self._totals.get(name)
+      if t is None:
+        self._totals[name] = [1, elapsed, elapsed]
+      else:
+        t[0] += 1
+        t[1] += elapsed
+        if elapsed > t[2]:
+          t[2] = elapsed
+
+  def _stack(self):
+    stack = getattr(self._local, 'stack', None)
+    if stack is None:
+      stack = self._local.stack = []
+    return stack
+
+  def stage(self, name):
+    '''Context manager timing one step of the current trace; a no-op outside one'''
+    if not self.enabled:
+      return _NULL
+    stack = self._stack()
+    if not stack:
+      return _NULL
+    return _Stage(self, stack[-1], name)
+
+  def count(self, name, n=1):
+    if not self.enabled:
+      return
+    with self._lock:
+      self._counters[name] = self._counters.get(name, 0) + n
+    stack = self._stack()
+    if stack:
+      c = stack[-1]['counters']
+      c[name] = c.get(name, 0) + n
+
+  def traced(self, name=None):
+    '''Decorator making each call a trace'''
+    def decorate(fn):
+      label = name or fn.__name__
+
+      def wrapper(*args, **kwargs):
+        if not self.enabled:
+          return fn(*args, **kwargs)
+        return self._call(label, fn, args, kwargs)
+      wrapper.__name__ = fn.__name__
+      wrapper.__doc__ = fn.__doc__
+      wrapper.__wrapped__ = fn
+      return wrapper
+    return decorate
+
+  def _call(self, name, fn, args, kwargs):
+    stack = self._stack()
+    outer = not stack
+    trace = {
+      'name': name,
+      'start': time.time(),
+      'thread': threading.current_thread().name,
+      'stages': {},
+      'counters': {},
+    }
+    profiler = None
+    tracing = False
+    if outer and self.profile:
+      profiler = cProfile.Profile()
+      try:
+        profiler.enable()
+      except ValueError:
+        # another thread is already profiling
+        profiler = None
+    if outer and self.memory and not tracemalloc.is_tracing():
+      tracemalloc.start()
+      tracing = True
+    stack.append(trace)
+    t = time.perf_counter()
+    try:
+      return fn(*args, **kwargs)
+    except Exception as e:
+      trace['error'] = repr(e)
+      raise
+    finally:
+      trace['duration'] = elapsed = time.perf_counter() - t
+      stack.pop()
+      if profiler is not None:
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(15)
+        trace['profile'] = out.getvalue()
+      if tracing:
+        trace['peak'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+      if stack:
+        # nested trace: its stages and counters also belong to the caller
+        parent = stack[-1]
+        for k, v in trace['stages'].items():
+          parent['stages'][k] = parent['stages'].get(k, 0.0) + v
+        for k, v in trace['counters'].items():
+          parent['counters'][k] = parent['counters'].get(k, 0) + v
+      self._add(name, elapsed)
+      self._export(trace)
+
+  def _export(self, trace):
+    for export in self.exporters:
+      try:
+        export(trace)
+      except Exception:
+        logging.getLogger('bikes').exception('instrument exporter failed')
+
+
+# The one every module instruments against.
+probe = Probe()
@@ -0,0 +1,98 @@
+'''
+Location fixes, cached for max_age seconds, from a pluggable backend.
+'''
+import threading
+import time
+
+
+class LocationUnavailable(IOError):
+  '''No fix has ever been had, e.g. location services are off or the first one hasn't arrived'''
+
+
+class Fix(object):
+  __slots__ = ('lat', 'lon', 'accuracy', 'timestamp')
+
+  def __init__(self, lat, lon, accuracy=None, timestamp=None):
+    self.lat = lat
+    self.lon = lon
+    self.accuracy = accuracy
+    self.timestamp = time.time() if timestamp is None else timestamp
+
+  def age(self):
+    return time.time() - self.timestamp
+
+
+class PythonistaBackend(object):
+  '''Fixes from Pythonista's location module'''
+  def __init__(self, settle=0.1):
+    self.settle = settle
+
+  def fix(self):
+    import location
+    location.start_updates()
+    try:
+      time.sleep(self.settle)
+      loc = location.get_location()
+    finally:
+      location.stop_updates()
+    if not loc:
+      return None
+    return Fix(
+      loc['latitude'],
+      loc['longitude'],
+      loc.get('horizontal_accuracy'),
+      loc.get('timestamp')
+    )
+
+
+class StaticBackend(object):
+  '''Always the same place; for tests and anywhere without a location module'''
+  def __init__(self, lat, lon, accuracy=5.0):
+    self.lat = lat
+    self.lon = lon
+    self.accuracy = accuracy
+    self.calls = 0
+
+  def fix(self):
+    self.calls += 1
+    return Fix(self.lat, self.lon, self.accuracy)
+
+
+class LocationProvider(object):
+  def __init__(self, backend=None, max_age=30, min_accuracy=None):
+    '''max_age in seconds; min_accuracy in metres, fixes with a larger error radius aren't reused'''
+    self.backend = backend or PythonistaBackend()
+    self.max_age = max_age
+    self.min_accuracy = min_accuracy
+    self.last = None
+    self._lock = threading.Lock()
+    self._stats = {'hits': 0, 'fixes': 0}
+
+  def stats(self):
+    return dict(self._stats)
+
+  def _usable(self, fix, max_age):
+    if fix is None or fix.age() > max_age:
+      return False
+    if self.min_accuracy is not None and fix.accuracy is not None:
+      return fix.accuracy <= self.min_accuracy
+    return True
+
+  def invalidate(self):
+    self.last = None
+
+  def get(self, max_age=None):
+    '''The current Fix, reusing the cached one when it's recent and accurate enough. Concurrent callers share one backend request. None only if there has never been a fix.'''
+    if max_age is None:
+      max_age = self.max_age
+    with self._lock:
+      if self._usable(self.last, max_age):
+        self._stats['hits'] += 1
+        return self.last
+      fix = self.backend.fix()
+      self._stats['fixes'] += 1
+      if fix is None:
+        # no fix right now; an old one beats nothing
+        return self.last
+      self.last = fix
+      return fix
@@ -14,6 +14,7 @@ import appex #py3
 import time
 import weakref
 import sys
+from pins import PinBuilder, PinMixin
 
 py3 = sys.version_info.major == 3
 
@@ -78,7 +79,13 @@ class MKCoordinateSpan (Structure):
 class MKCoordinateRegion (Structure):
 	_fields_ = [('center', CLLocationCoordinate2D), ('span', MKCoordinateSpan)]
 
-class MapView (ui.View):
+# Builds annotations with the Objective-C classes looked up once, for add_pin and add_pins
+_pins = PinBuilder(ObjCClass, CLLocationCoordinate2D)
+
+class MapView (PinMixin, ui.View):
+	pin_builder = _pins
+	region_type = MKCoordinateRegion
+
 	@on_main_thread
 	def __init__(self, *args, **kwargs):
 		ui.View.__init__(self, *args, **kwargs)
@@ -101,6 +108,7 @@ class MapView (ui.View):
 		self.mk_map_view.release()
 		self.long_press_action = None
 		self.scroll_action = None
+		self._init_pins()
 		#NOTE: The button is only used as a convenient action target for the gesture recognizer. While this isn't documented, the underlying UIButton object has an `-invokeAction:` method that takes care of calling the associated Python action.
 		self.gesture_recognizer_target = ui.Button()
 		self.gesture_recognizer_target.action = self.long_press
@@ -126,22 +134,11 @@ class MapView (ui.View):
 	@on_main_thread
 	def add_pin(self, lat, lon, title, subtitle=None, select=False):
 		'''Add a pin annotation to the map'''
-		MKPointAnnotation = ObjCClass('MKPointAnnotation')
-		coord = CLLocationCoordinate2D(lat, lon)
-		annotation = MKPointAnnotation.alloc().init().autorelease()
-		annotation.setTitle_(title)
-		if subtitle:
-			annotation.setSubtitle_(subtitle)
-		annotation.setCoordinate_(coord, restype=None, argtypes=[CLLocationCoordinate2D])
+		annotation = _pins.annotation(lat, lon, title, subtitle)
 		self.mk_map_view.addAnnotation_(annotation)
 		if select:
 			self.mk_map_view.selectAnnotation_animated_(annotation, True)
 
-	@on_main_thread
-	def remove_all_pins(self):
-		'''Remove all annotations (pins) from the map'''
-		self.mk_map_view.removeAnnotations_(self.mk_map_view.annotations())
-
 	@on_main_thread
 	def set_region(self, lat, lon, d_lat, d_lon, animated=False):
 		'''Set latitude/longitude of the view's center and the zoom level (specified implicitly as a latitude/longitude delta)'''
@@ -167,6 +164,8 @@ class MapView (ui.View):
 		return coordinate.latitude, coordinate.longitude
 
 	def _notify_region_changed(self):
+		if self.viewport is not None:
+			self.viewport.region_changed(self.get_region())
 		if callable(self.scroll_action):
 			self.scroll_action(self)
 
@@ -242,14 +241,10 @@ def update(v):
 			'Current Location', 
 			str((lat, lon))
 		)
-		for name,d in home_stations.items():
-			v.add_pin(
-				d['lat'],
-				d['lon'],
-				name,
-				str((d['lat'],
-				d['lon']))
-			)
+		v.add_pins(
+			(d['lat'], d['lon'], name, str((d['lat'], d['lon'])))
+			for name,d in home_stations.items()
+		)
 
 if __name__ == '__main__':
 	update(create())
@@ -13,6 +13,9 @@ import location
 import time
 import weakref
 import sys
+from pins import PinBuilder, PinMixin
+from viewport import ViewportManager
+from scheduler import RefreshScheduler
 import bikes
 
 py3 = sys.version_info.major == 3
@@ -83,7 +86,13 @@ class MKCoordinateRegion (Structure):
 		('span', MKCoordinateSpan)
 	]
 
-class MapView (ui.View):
+# Builds annotations with the Objective-C classes looked up once, for add_pin and add_pins
+_pins = PinBuilder(ObjCClass, CLLocationCoordinate2D)
+
+class MapView (PinMixin, ui.View):
+	pin_builder = _pins
+	region_type = MKCoordinateRegion
+
 	@on_main_thread
 	def __init__(self, *args, **kwargs):
 		ui.View.__init__(self, *args, **kwargs)
@@ -103,6 +112,10 @@ class MapView (ui.View):
 		self.mk_map_view.release()
 		self.long_press_action = None
 		self.scroll_action = None
+		self._init_pins()
+		# a RefreshScheduler and a (tracker, callback) subscription kept while the view is open; will_close stops both
+		self.refresher = None
+		self.listening = None
 		#NOTE: The button is only used as a convenient action target for the gesture recognizer. While this isn't documented, the underlying UIButton object has an `-invokeAction:` method that takes care of calling the associated Python action.
 		self.gesture_recognizer_target = ui.Button()
 		self.gesture_recognizer_target.action = self.long_press
@@ -138,35 +151,10 @@ class MapView (ui.View):
 	@on_main_thread
 	def add_pin(self, lat, lon, title, subtitle=None, select=False):
 		'''Add a pin annotation to the map'''
-		MKPointAnnotation = ObjCClass(
-			'MKPointAnnotation'
-		)
-		coord = CLLocationCoordinate2D(lat, lon)
-		annotation = MKPointAnnotation.alloc(
-		).init().autorelease()
-		annotation.setTitle_(title)
-		if subtitle:
-			annotation.setSubtitle_(subtitle)
-		annotation.setCoordinate_(
-			coord, 
-			restype=None, argtypes=[CLLocationCoordinate2D]
-		)
-		self.mk_map_view.addAnnotation_(
-			annotation
-		)
+		annotation = _pins.annotation(lat, lon, title, subtitle)
+		self.mk_map_view.addAnnotation_(annotation)
 		if select:
-			(
-				self.mk_map_view
-			).selectAnnotation_animated_(
-				annotation, True
-			)
-
-	@on_main_thread
-	def remove_all_pins(self):
-		'''Remove all annotations (pins) from the map'''
-		self.mk_map_view.removeAnnotations_(
-			self.mk_map_view.annotations()
-		)
+			self.mk_map_view.selectAnnotation_animated_(annotation, True)
 
 	@on_main_thread
 	def set_region(self, lat, lon, d_lat, d_lon, animated=False):
@@ -206,9 +194,21 @@ class MapView (ui.View):
 		return coordinate.latitude, coordinate.longitude
 
 	def _notify_region_changed(self):
+		if self.viewport is not None:
+			self.viewport.region_changed(self.get_region())
 		if callable(self.scroll_action):
 			self.scroll_action(self)
 
+	def will_close(self):
+		if self.refresher is not None:
+			self.refresher.stop()
+		if self.viewport is not None:
+			self.viewport.cancel()
+		if self.listening is not None:
+			tracker, callback = self.listening
+			tracker.unsubscribe(callback)
+			self.listening = None
+
 
 # --------------------------------------
 # DEMO:
@@ -334,28 +334,23 @@ def main():
 			str((lat, lon)),
 			#select=True
 		)
-		#lon=-2
-		if lon>-0.07:
-			stations=home_stations
-		else:
-			stations=work_stations
-		#bikes.get_close_stations()
-		for name,d in stations.items():
-
-			response = bikes.get_bikes_and_spaces(
-				d['id']
-			)
-			if response is None:
-				continue
-			b,s = response
-			
-			v.add_pin(
-				d['lat'],
-				d['lon'],
-				'%s/%s'%(b,b+s),
-				name
-				#str((d['lat'],d['lon']))
-			)
+		# only what's in view is on the map, clustered to suit the zoom; panning and zooming add and remove pins as needed
+		v.viewport = ViewportManager(
+			bikes.get_station_clusters,
+			v.add_clusters,
+			v.remove_pins,
+			update=v.update_clusters
+		)
+		v.viewport.refresh(v.get_region())
+		# every availability refresh redraws just the pins whose counts changed
+		redraw = lambda diff: v.viewport.refresh()
+		bikes.tracker.subscribe(redraw)
+		v.listening = (bikes.tracker, redraw)
+		v.refresher = RefreshScheduler(
+			bikes.refresh_availability,
+			interval=lambda: 60
+		)
+		v.refresher.start()
 	#import appex #py3
 	#appex.set_widget_view(v)
 	
@@ -13,6 +13,7 @@ import location
 import time
 import weakref
 import sys
+from pins import PinBuilder, PinMixin, ViewPool, address, state_for
 import bikes
 	
 py3 = (sys.version_info.major == 3)
@@ -73,48 +74,27 @@ except:
 
 	# -- max classes below --
 	IMPTYPE2 = ctypes.CFUNCTYPE(
-		None, c_void_p, 
+		c_void_p, c_void_p, 
 		c_void_p, c_void_p, c_void_p
 	)
 	def mapView_viewForAnnotation_imp(
 			self, cmd, mk_mapview, annotation
 		):
-		'''
-		global mmv
-		mmv = mk_mapview
-		global ann
-		ann = annotation
-		'''
-		identifier = 'BikeMarker'
-		mv = ObjCClass(
-			'MKMarkerAnnotationView'
-		).alloc()#.init().autorelease()
-		return mv
-		#).initWithAnnotation_reuseIdentifier_(annotation, identifier)
-		#if annotation.isKind(
-			#MKUserLocation.self):
-			#return None
-		annotationView = None
-		'''
 		# Resolve weak reference from delegate to mapview:
 		map_view = _map_delegate_cache[
 			self
 		].map_view_ref()
-		if map_view:
-			annotationView = map_view.dequeueReusableAnnotationView(
-				identifier
-			)
-		'''
-		if not annotationView:
-			annotationView = ObjCClass(
-				'MKMarkerAnnotationView'
-			).alloc(
-			).initWithAnnotation_reuseIdentifier_(
-				annotation, identifier
-			)
-		annotationView.glyphText = '    '
-		annotationView.markerTintColor = UIColor.blue
-		return annotationView
+		if not map_view:
+			return None
+		# pins added without a state (and the user location) get the default view
+		view = _views.view_for(
+			ObjCInstance(mk_mapview),
+			ObjCInstance(annotation),
+			map_view.pin_state(annotation)
+		)
+		if view is None:
+			return None
+		return view.ptr
 		
 	imp2 = IMPTYPE2(
 		mapView_viewForAnnotation_imp
@@ -130,7 +110,7 @@ except:
 		sel2, 
 		imp2, 
 		(
-			py23('@0@0:0@0#0')
+			py23('@@:@@')
 		)
 	)
 	
@@ -155,10 +135,19 @@ class MKCoordinateRegion (Structure):
 		('center', CLLocationCoordinate2D), 
 		('span', MKCoordinateSpan)
 	]
+
+# Builds annotations with the Objective-C classes looked up once, for add_pin and add_pins
+_pins = PinBuilder(ObjCClass, CLLocationCoordinate2D)
+# Marker views for mapView:viewForAnnotation:, reused per station state
+_views = ViewPool(ObjCClass)
+
 class MapViewController():
 	pass
 	
-class MapView (ui.View):
+class MapView (PinMixin, ui.View):
+	pin_builder = _pins
+	region_type = MKCoordinateRegion
+
 	@on_main_thread
 	def __init__(self, *args, **kwargs):
 		ui.View.__init__(self, *args, **kwargs)
@@ -178,6 +167,7 @@ class MapView (ui.View):
 		self.mk_map_view.release()
 		self.long_press_action = None
 		self.scroll_action = None
+		self._init_pins()
 		#NOTE: The button is only used as a convenient action target for the gesture recognizer. While this isn't documented, the underlying UIButton object has an `-invokeAction:` method that takes care of calling the associated Python action.
 		self.gesture_recognizer_target = ui.Button()
 		self.gesture_recognizer_target.action = self.long_press
@@ -214,39 +204,20 @@ class MapView (ui.View):
 	@on_main_thread
 	def add_pin(self, lat, lon, title, subtitle=None, select=False):
 		'''Add a pin annotation to the map'''
-		
-		MKPointAnnotation = ObjCClass(
-			'MKPointAnnotation'
-			#'MKMarkerAnnotationView'
-		)
-		#mkmarkview = ObjCClass('MKMarkerAnnotationView')
-		#mk = mkmarkview.alloc().init().autorelease()
-		coord = CLLocationCoordinate2D(lat, lon)
-		annotation = MKPointAnnotation.alloc(
-		).init().autorelease()
-		annotation.setTitle_(title)
-		if subtitle:
-			annotation.setSubtitle_(subtitle)
-		annotation.setCoordinate_(
-			coord, 
-			restype=None, argtypes=[CLLocationCoordinate2D]
-		)
-		self.mk_map_view.addAnnotation_(
-			annotation
-		)
+		annotation = _pins.annotation(lat, lon, title, subtitle)
+		self.mk_map_view.addAnnotation_(annotation)
 		if select:
-			(
-				self.mk_map_view
-			).selectAnnotation_animated_(
-				annotation, True
-			)
+			self.mk_map_view.selectAnnotation_animated_(annotation, True)
 
-	@on_main_thread
-	def remove_all_pins(self):
-		'''Remove all annotations (pins) from the map'''
-		self.mk_map_view.removeAnnotations_(
-			self.mk_map_view.annotations()
-		)
+	def _restyle(self, annotation, state):
+		key = address(annotation)
+		if self.pin_states.get(key) == state:
+			return
+		self.pin_states[key] = state
+		# a pin on screen keeps its view, so retint that; off-screen ones get theirs from the delegate
+		view = self.mk_map_view.viewForAnnotation_(annotation)
+		if view is not None and state in _views.TINTS:
+			_views.configure(view, state)
 
 	@on_main_thread
 	def set_region(self, lat, lon, d_lat, d_lon, animated=False):
@@ -286,6 +257,8 @@ class MapView (ui.View):
 		return coordinate.latitude, coordinate.longitude
 
 	def _notify_region_changed(self):
+		if self.viewport is not None:
+			self.viewport.region_changed(self.get_region())
 		if callable(self.scroll_action):
 			self.scroll_action(self)
 
@@ -422,18 +395,25 @@ def main():
 		else:
 			stations=work_stations
 		#bikes.get_close_stations()
+		available = bikes.get_availability(
+			[d['id'] for d in stations.values()]
+		)
+		pins = []
 		for name,d in stations.items():
-			b,s=bikes.get_bikes_and_spaces(
-				d['id']
-			)
+			response = available.get(d['id'])
+			if response is None:
+				continue
+			b,s = response
 			
-			v.add_pin(
+			pins.append((
 				d['lat'],
 				d['lon'],
 				'%s/%s'%(b,b+s),
-				name
+				name,
 				#str((d['lat'],d['lon']))
-			)
+				state_for(b)
+			))
+		v.add_pins(pins)
 	#import appex #py3
 	#appex.set_widget_view(v)
 	
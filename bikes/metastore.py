@@ -0,0 +1,179 @@
+'''
+Fixed-record binary file of the station metadata (id -> name, lat, lon), opened with mmap so processes share one copy.
+
+Layout, little-endian:
+
+  header   magic b'BKMM', version, record size, count, string table offset, crc of everything after the header
+  records  count x (lat f64, lon f64, id offset, id length, name offset, name length), sorted by id
+  strings  utf-8 ids and names
+'''
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+
+MAGIC = b'BKMM'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIII')
+RECORD = struct.Struct('<ddIIII')
+
+
+def write_atomic(path, data):
+  '''Write to a temp file next to path and rename it into place'''
+  d = os.path.dirname(path) or '.'
+  fd, tmp = tempfile.mkstemp(dir=d, prefix='.tmp-')
+  try:
+    with os.fdopen(fd, 'wb') as f:
+      f.write(data)
+    os.replace(tmp, path)
+  except BaseException:
+    if os.path.exists(tmp):
+      os.remove(tmp)
+    raise
+
+
+def pack(rows):
+  '''File contents for an iterable of (id, name, lat, lon)'''
+  rows = sorted(rows, key=lambda r: r[0].encode('utf-8'))
+  n = len(rows)
+  strings = bytearray()
+  records = bytearray()
+  base = HEADER.size + n * RECORD.size
+  for sid, name, lat, lon in rows:
+    i = sid.encode('utf-8')
+    nm = name.encode('utf-8')
+    records += RECORD.pack(
+      lat, lon,
+      base + len(strings), len(i),
+      base + len(strings) + len(i), len(nm)
+    )
+    strings += i + nm
+  body = bytes(records + strings)
+  return HEADER.pack(
+    MAGIC, VERSION, RECORD.size, n, base,
+    zlib.crc32(body) & 0xffffffff
+  ) + body
+
+
+def write(stations, path):
+  '''Write Station objects (anything with id, name, lat, lon)'''
+  write_atomic(path, pack(
+    (s.id, s.name, s.lat, s.lon) for s in stations
+  ))
+
+
+def write_simple(stations, path):
+  '''Write the name -> (id, lat, lon) mapping from bikes.json'''
+  write_atomic(path, pack(
+    (sid, name, lat, lon)
+    for name, (sid, lat, lon) in stations.items()
+  ))
+
+
+def read_crc(path):
+  '''crc from the header, or None if path isn't a store of this version'''
+  try:
+    with open(path, 'rb') as f:
+      head = f.read(HEADER.size)
+  except (IOError, OSError):
+    return None
+  if len(head) < HEADER.size:
+    return None
+  magic, version, size, n, strings, crc = HEADER.unpack(head)
+  if magic != MAGIC or version != VERSION:
+    return None
+  return crc
+
+
+class MetaStore(object):
+  def __init__(self, path, verify=False):
+    self.path = path
+    with open(path, 'rb') as f:
+      self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    self.buf = memoryview(self._mm)
+    if len(self.buf) < HEADER.size:
+      self.close()
+      raise ValueError('%s: truncated' % path)
+    magic, version, size, n, strings, crc = HEADER.unpack_from(self.buf)
+    if magic != MAGIC or version != VERSION or size != RECORD.size:
+      self.close()
+      raise ValueError('%s: not a version %s station store' % (path, VERSION))
+    if verify and zlib.crc32(self.buf[HEADER.size:]) & 0xffffffff != crc:
+      self.close()
+      raise ValueError('%s: checksum mismatch' % path)
+    self.count = n
+    self.crc = crc
+
+  def close(self):
+    if self.buf is not None:
+      self.buf.release()
+      self.buf = None
+      self._mm.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def __len__(self):
+    return self.count
+
+  def _record(self, i):
+    return RECORD.unpack_from(self.buf, HEADER.size + i * RECORD.size)
+
+  def _id_bytes(self, i):
+    lat, lon, io, il, no, nl = self._record(i)
+    return self.buf[io:io + il]
+
+  def coords(self, i):
+    '''(lat, lon) of record i'''
+    return struct.unpack_from('<dd', self.buf, HEADER.size + i * RECORD.size)
+
+  def id(self, i):
+    return bytes(self._id_bytes(i)).decode('utf-8')
+
+  def name(self, i):
+    lat, lon, io, il, no, nl = self._record(i)
+    return bytes(self.buf[no:no + nl]).decode('utf-8')
+
+  def index_of(self, sid):
+    '''Record number of sid, or -1. Binary search over the sorted ids.'''
+    key = sid.encode('utf-8')
+    lo, hi = 0, self.count
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if self._id_bytes(mid).tobytes() < key:
+        lo = mid + 1
+      else:
+        hi = mid
+    if lo < self.count and self._id_bytes(lo) == key:
+      return lo
+    return -1
+
+  def get(self, sid):
+    '''(name, lat, lon) for sid, or None'''
+    i = self.index_of(sid)
+    if i < 0:
+      return None
+    lat, lon = self.coords(i)
+    return self.name(i), lat, lon
+
+  def __iter__(self):
+    '''(id, name, lat, lon) in id order'''
+    buf = self.buf
+    for i in range(self.count):
+      lat, lon, io, il, no, nl = self._record(i)
+      yield (
+        bytes(buf[io:io + il]).decode('utf-8'),
+        bytes(buf[no:no + nl]).decode('utf-8'),
+        lat, lon
+      )
+
+  def to_simple(self):
+    '''The bikes.json shape: name -> (id, lat, lon)'''
+    return {
+      name: (sid, lat, lon)
+      for sid, name, lat, lon in self
+    }
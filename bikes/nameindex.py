@@ -0,0 +1,147 @@
+'''
+Station name search tolerating abbreviations, prefixes and typos.
+'''
+from bisect import bisect_left
+import heapq
+import re
+import unicodedata
+
+ABBREVIATIONS = {
+  'st': ('street', 'saint'),
+  'rd': ('road',),
+  'sq': ('square',),
+  'pl': ('place',),
+  'ave': ('avenue',),
+  'av': ('avenue',),
+  'ln': ('lane',),
+  'gdns': ('gardens',),
+  'gdn': ('garden',),
+  'stn': ('station',),
+  'br': ('bridge',),
+  'ct': ('court',),
+  'cres': ('crescent',),
+  'tce': ('terrace',),
+  'terr': ('terrace',),
+  'mt': ('mount',),
+  'nth': ('north',),
+  'sth': ('south',),
+  'gt': ('great',),
+}
+
+_SPLIT = re.compile(r'[^a-z0-9]+')
+
+
+def tokens(text):
+  '''Normalized tokens of a name or query: "St. Chad's Street" -> ['st', 'chads', 'street']'''
+  text = unicodedata.normalize('NFKD', text)
+  text = ''.join(c for c in text if not unicodedata.combining(c))
+  text = text.lower().replace("'", '').replace(u'’', '').replace('&', ' and ')
+  return [t for t in _SPLIT.split(text) if t]
+
+
+def trigrams(token):
+  t = '$%s$' % token
+  return set(t[i:i + 3] for i in range(len(t) - 2))
+
+
+class NameIndex(object):
+  '''Ranked name lookups over `items`, anything with a `name` (Stations, usually)'''
+  def __init__(self, items, fuzzy=0.4):
+    self.items = list(items)
+    self.fuzzy = fuzzy
+    self.names = []
+    self.postings = {}
+    for pos, item in enumerate(self.items):
+      toks = tokens(item.name)
+      self.names.append(' '.join(toks))
+      for t in toks:
+        for form in (t,) + ABBREVIATIONS.get(t, ()):
+          self.postings.setdefault(form, set()).add(pos)
+    self.vocab = sorted(self.postings)
+    self.grams = {}
+    for t in self.vocab:
+      for g in trigrams(t):
+        self.grams.setdefault(g, []).append(t)
+    self._matches = {}
+
+  @classmethod
+  def from_stations(cls, stations):
+    return cls(stations)
+
+  def __len__(self):
+    return len(self.items)
+
+  def _prefixed(self, prefix):
+    i = bisect_left(self.vocab, prefix)
+    while i < len(self.vocab) and self.vocab[i].startswith(prefix):
+      yield self.vocab[i]
+      i += 1
+
+  def _similar(self, token):
+    grams = trigrams(token)
+    shared = {}
+    for g in grams:
+      for t in self.grams.get(g, ()):
+        shared[t] = shared.get(t, 0) + 1
+    for t, n in shared.items():
+      sim = n / float(len(grams) + len(t) - n)
+      if sim >= self.fuzzy:
+        yield t, sim
+
+  def matches(self, token):
+    '''{vocabulary token: score} for one query token: 1 for exact matches (abbreviations included), less for prefixes of longer tokens, less again for fuzzy ones. Memoized, the vocabulary never changes.'''
+    hit = self._matches.get(token)
+    if hit is not None:
+      return hit
+    found = {}
+    for form in (token,) + ABBREVIATIONS.get(token, ()):
+      if form in self.postings:
+        found[form] = 1.0
+    for t in self._prefixed(token):
+      if t not in found:
+        found[t] = 0.5 + 0.4 * len(token) / len(t)
+    if not found:
+      for t, sim in self._similar(token):
+        found[t] = 0.6 * sim
+    if len(self._matches) > 4096:
+      self._matches.clear()
+    self._matches[token] = found
+    return found
+
+  def search(self, query, limit=10):
+    '''Items best matching query, best first. Every query token has to match one of the name's tokens, exactly, as a prefix or fuzzily; names containing the query as typed rank above the rest.'''
+    qt = tokens(query)
+    if not qt:
+      return []
+    scores = None
+    for q in qt:
+      best = {}
+      for t, score in self.matches(q).items():
+        for pos in self.postings[t]:
+          if score > best.get(pos, 0.0):
+            best[pos] = score
+      if scores is None:
+        scores = best
+      else:
+        scores = {
+          pos: s + best[pos]
+          for pos, s in scores.items()
+          if pos in best
+        }
+      if not scores:
+        return []
+    phrase = ' '.join(qt)
+    ranked = heapq.nsmallest(
+      limit,
+      scores,
+      key=lambda pos: (
+        -(scores[pos] + (0.5 if phrase in self.names[pos] else 0.0)),
+        len(self.names[pos]),
+        pos
+      )
+    )
+    return [self.items[pos] for pos in ranked]
+
+  def best(self, query):
+    found = self.search(query, 1)
+    return found[0] if found else None
@@ -0,0 +1,239 @@
+'''
+Pins on an MKMapView: PinBuilder makes annotations, ViewPool reuses marker views per station state, PinMixin keeps the MapViews' keyed pins.
+'''
+try:
+  from objc_util import on_main_thread
+except ImportError:
+  # off the device there's no main thread to hop to
+  def on_main_thread(fn):
+    return fn
+
+
+def state_for(bikes, low=3):
+  '''Station state for a count: empty, low (under `low`) or plenty'''
+  if bikes <= 0:
+    return 'empty'
+  if bikes < low:
+    return 'low'
+  return 'plenty'
+
+
+def address(obj):
+  '''The integer address of an ObjCInstance or pointer, for keying dicts by Objective-C object'''
+  ptr = getattr(obj, 'ptr', obj)
+  return getattr(ptr, 'value', ptr)
+
+
+class PinBuilder(object):
+  def __init__(self, objc_class, coordinate):
+    '''objc_class(name) returns an Objective-C class (objc_util.ObjCClass); coordinate(lat, lon) builds a CLLocationCoordinate2D'''
+    self.objc_class = objc_class
+    self.coordinate = coordinate
+    self._classes = {}
+
+  def cls(self, name):
+    c = self._classes.get(name)
+    if c is None:
+      c = self._classes[name] = self.objc_class(name)
+    return c
+
+  def annotation(self, lat, lon, title, subtitle=None, state=None):
+    '''An MKPointAnnotation; state is for the view pool and isn't stored on the annotation'''
+    a = self.cls('MKPointAnnotation').alloc().init().autorelease()
+    a.setTitle_(title)
+    if subtitle:
+      a.setSubtitle_(subtitle)
+    a.setCoordinate_(
+      self.coordinate(lat, lon),
+      restype=None, argtypes=[self.coordinate]
+    )
+    return a
+
+  def update(self, annotation, lat, lon, title, subtitle=None, state=None):
+    '''Point an existing annotation at a changed pin, in place'''
+    annotation.setTitle_(title)
+    annotation.setSubtitle_(subtitle or '')
+    annotation.setCoordinate_(
+      self.coordinate(lat, lon),
+      restype=None, argtypes=[self.coordinate]
+    )
+
+  def build(self, pins):
+    '''One annotation per (lat, lon, title[, subtitle[, state]]) in pins'''
+    annotation = self.annotation
+    return [annotation(*pin) for pin in pins]
+
+
+class ViewPool(object):
+  TINTS = {
+    'empty': 'systemRedColor',
+    'low': 'systemOrangeColor',
+    'plenty': 'systemGreenColor',
+    'cluster': 'systemBlueColor',
+  }
+
+  def __init__(self, objc_class, view_class='MKMarkerAnnotationView'):
+    self.objc_class = objc_class
+    self.view_class = view_class
+    self._classes = {}
+    self._tints = {}
+    self._stats = {'hits': 0, 'misses': 0}
+
+  def stats(self):
+    '''hits (a dequeued view was reconfigured), misses (a view had to be allocated)'''
+    return dict(self._stats)
+
+  def cls(self, name):
+    c = self._classes.get(name)
+    if c is None:
+      c = self._classes[name] = self.objc_class(name)
+    return c
+
+  def identifier(self, state):
+    return 'BikeMarker.' + state
+
+  def tint(self, state):
+    t = self._tints.get(state)
+    if t is None:
+      t = self._tints[state] = getattr(
+        self.cls('UIColor'), self.TINTS[state]
+      )()
+    return t
+
+  def view_for(self, mk_map_view, annotation, state):
+    '''A marker view for annotation in the given state: a dequeued one if the map has one spare, else a new one. None for annotations without a state (the user location, plain pins), so the map draws its default.'''
+    if state not in self.TINTS:
+      return None
+    ident = self.identifier(state)
+    view = mk_map_view.dequeueReusableAnnotationViewWithIdentifier_(ident)
+    if view is not None:
+      self._stats['hits'] += 1
+      view.setAnnotation_(annotation)
+    else:
+      self._stats['misses'] += 1
+      view = self.cls(self.view_class).alloc(
+      ).initWithAnnotation_reuseIdentifier_(
+        annotation, ident
+      ).autorelease()
+    # set on hits too: a view can have been retinted in place since it was queued
+    self.configure(view, state)
+    return view
+
+  def configure(self, view, state):
+    '''Style a view for state, e.g. when its station changes state while on screen'''
+    view.setMarkerTintColor_(self.tint(state))
+
+
+class PinMixin(object):
+  '''Keyed, batched pins for a MapView. The view sets pin_builder (a PinBuilder) and region_type (its MKCoordinateRegion structure), calls _init_pins() from __init__ and has an mk_map_view. Override _restyle to retint on-screen views when a pin changes state.'''
+  pin_builder = None
+  region_type = None
+
+  def _init_pins(self):
+    # key (e.g. station id) -> annotation, for pins added with keys
+    self.pins = {}
+    # annotation address -> station state, for pins added with one (see ViewPool)
+    self.pin_states = {}
+    # a viewport.ViewportManager, if pins should follow the visible region
+    self.viewport = None
+
+  @on_main_thread
+  def add_pins(self, pins):
+    '''Add many pins in one go: pins is an iterable of (lat, lon, title), (lat, lon, title, subtitle) or (lat, lon, title, subtitle, state) tuples, or a dict of them by key (a station id, say) so they can be removed by key later. state ('empty', 'low', 'plenty' or 'cluster') picks the marker style. All the annotations are built in this one main-thread call and handed to the map with a single addAnnotations_, so build anything slow (like availability) before calling. Returns the annotations.'''
+    if isinstance(pins, dict):
+      keys = list(pins)
+      pins = [pins[k] for k in keys]
+      annotations = self.pin_builder.build(pins)
+      old = [self.pins[k] for k in keys if k in self.pins]
+      if old:
+        self._forget(old)
+        self.mk_map_view.removeAnnotations_(old)
+      self.pins.update(zip(keys, annotations))
+    else:
+      pins = list(pins)
+      annotations = self.pin_builder.build(pins)
+    for pin, annotation in zip(pins, annotations):
+      if len(pin) > 4:
+        self.pin_states[address(annotation)] = pin[4]
+    if annotations:
+      self.mk_map_view.addAnnotations_(annotations)
+    return annotations
+
+  def _forget(self, annotations):
+    for annotation in annotations:
+      self.pin_states.pop(address(annotation), None)
+
+  def pin_state(self, annotation):
+    '''The state the pin for annotation was added with, or None'''
+    return self.pin_states.get(address(annotation))
+
+  @on_main_thread
+  def add_clusters(self, clusters):
+    '''Add cluster.Cluster annotations, a dict of them by key as returned by bikes.get_station_clusters. A cluster is titled with its summed counts; one holding a single station looks like that station's pin.'''
+    return self.add_pins({
+      key: cl.pin() for key, cl in clusters.items()
+    })
+
+  @on_main_thread
+  def update_pins(self, changes, add=True):
+    '''Apply {key: pin, or None} to the keyed pins: existing pins get their title, subtitle, position and state changed in place, None removes a pin and, with add, unknown keys are added. Costs bridge calls for the changed pins only.'''
+    retired = [k for k, pin in changes.items() if pin is None]
+    new = {}
+    for key, pin in changes.items():
+      if pin is None:
+        continue
+      annotation = self.pins.get(key)
+      if annotation is None:
+        if add:
+          new[key] = pin
+        continue
+      self.pin_builder.update(annotation, *pin)
+      if len(pin) > 4:
+        self._restyle(annotation, pin[4])
+    if retired:
+      self.remove_pins(retired)
+    if new:
+      self.add_pins(new)
+
+  @on_main_thread
+  def update_clusters(self, changes):
+    '''update_pins for cluster.Cluster values, as a viewport's update callback'''
+    self.update_pins({
+      key: cl.pin() if cl is not None else None
+      for key, cl in changes.items()
+    })
+
+  def _restyle(self, annotation, state):
+    self.pin_states[address(annotation)] = state
+
+  @on_main_thread
+  def remove_pins(self, keys):
+    '''Remove the pins added under these keys, in one removeAnnotations_'''
+    annotations = [
+      self.pins.pop(k) for k in keys if k in self.pins
+    ]
+    if annotations:
+      self._forget(annotations)
+      self.mk_map_view.removeAnnotations_(annotations)
+
+  @on_main_thread
+  def remove_all_pins(self):
+    '''Remove all annotations (pins) from the map'''
+    self.mk_map_view.removeAnnotations_(
+      self.mk_map_view.annotations()
+    )
+    self.pins.clear()
+    self.pin_states.clear()
+    if self.viewport is not None:
+      self.viewport.reset()
+
+  @on_main_thread
+  def get_region(self):
+    '''Return the visible region as a (latitude, longitude, latitude delta, longitude delta) tuple'''
+    region = self.mk_map_view.region(
+      restype=self.region_type, argtypes=[]
+    )
+    return (
+      region.center.latitude, region.center.longitude,
+      region.span.d_lat, region.span.d_lon
+    )
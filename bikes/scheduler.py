@@ -0,0 +1,79 @@
+'''
+Background refresh for the widget, on an interval that follows the commute.
+'''
+import datetime
+import threading
+import time
+
+
+def commute_interval(now=None, fast=30, slow=180):
+  '''Seconds until the next refresh: `fast` on weekday mornings and evenings, `slow` the rest of the time'''
+  if now is None:
+    now = datetime.datetime.now()
+  if now.weekday() < 5 and (7 <= now.hour < 10 or 16 <= now.hour < 19):
+    return fast
+  return slow
+
+
+class RefreshScheduler(object):
+  def __init__(self, job, interval=commute_interval):
+    '''job() does one refresh and returns its result; interval() returns the seconds to wait before the next one'''
+    self.job = job
+    self.interval = interval
+    self.latest = None
+    self.latest_at = None
+    self.error = None
+    self._running = threading.Lock()
+    self._wake = threading.Event()
+    self._stop = threading.Event()
+    # guards _thread, so start() and a loop that's on its way out can't miss each other
+    self._state = threading.Lock()
+    self._thread = None
+
+  @property
+  def running(self):
+    return self._running.locked()
+
+  def start(self):
+    '''Start the background thread, which refreshes immediately. Safe to call repeatedly, and straight after stop().'''
+    with self._state:
+      self._stop.clear()
+      if self._thread is not None:
+        # still running, perhaps told to stop; it carries on
+        return
+      self._thread = threading.Thread(target=self._loop, name='refresh')
+      self._thread.daemon = True
+      self._thread.start()
+
+  def stop(self):
+    self._stop.set()
+    self._wake.set()
+
+  def poke(self):
+    '''Refresh now instead of at the end of the current interval'''
+    self._wake.set()
+
+  def run(self, job=None, wait=False):
+    '''Run job (default: the scheduled one) on this thread unless a refresh is already running, or with wait after it. Returns False if it was skipped.'''
+    if not self._running.acquire(wait):
+      return False
+    try:
+      result = (job or self.job)()
+      self.latest = result
+      self.latest_at = time.time()
+      self.error = None
+    except Exception as e:
+      self.error = e
+    finally:
+      self._running.release()
+    return True
+
+  def _loop(self):
+    while True:
+      with self._state:
+        if self._stop.is_set():
+          self._thread = None
+          return
+      self.run()
+      self._wake.wait(self.interval())
+      self._wake.clear()
@@ -0,0 +1,178 @@
+'''
+Shared TTL cache of the /BikePoint feed, revalidated with ETag/Last-Modified.
+'''
+import threading
+import time
+
+from instrument import probe
+
+
+class Snapshot(object):
+  '''One parsed copy of the feed. `version` only changes when the body does.'''
+  def __init__(self, data, etag=None, last_modified=None, fetched_at=0.0, version=0):
+    self.data = data
+    self.etag = etag
+    self.last_modified = last_modified
+    self.fetched_at = fetched_at
+    self.version = version
+
+  def age(self, now=None):
+    if now is None:
+      now = time.time()
+    return now - self.fetched_at
+
+
+class _Flight(object):
+  def __init__(self):
+    self.done = threading.Event()
+    self.snapshot = None
+    self.error = None
+
+
+class SnapshotStore(object):
+  '''What FeedCache and aio.AsyncFeedCache share: the snapshot, values derived from it, the stats, and turning a response into the next snapshot. Subclasses do the fetching.'''
+  def __init__(self, ttl):
+    self.ttl = ttl
+    self.snapshot = None
+    self._lock = threading.Lock()
+    self._derived = {}
+    self._stats = {
+      'hits': 0,
+      'misses': 0,
+      'shared': 0,
+      'refreshes': 0,
+      'not_modified': 0,
+      'errors': 0,
+    }
+
+  def stats(self):
+    '''Counters: hits (served fresh from cache), misses (had to go to the network), shared (waited on another caller's fetch), refreshes (new body), not_modified (304 revalidations), errors'''
+    with self._lock:
+      s = dict(self._stats)
+    snap = self.snapshot
+    s['version'] = snap.version if snap else None
+    s['age'] = snap.age() if snap else None
+    return s
+
+  def clear(self):
+    '''Drop the snapshot entirely, so the next get() downloads the whole feed again'''
+    with self._lock:
+      self.snapshot = None
+      self._derived = {}
+
+  def invalidate(self):
+    '''Force the next get() to revalidate'''
+    with self._lock:
+      if self.snapshot is not None:
+        self.snapshot.fetched_at = 0.0
+
+  def _count(self, name):
+    with self._lock:
+      self._stats[name] += 1
+
+  def _headers(self, snap):
+    headers = {'Cache-Control': 'no-cache'}
+    if snap is not None:
+      if snap.etag:
+        headers['If-None-Match'] = snap.etag
+      if snap.last_modified:
+        headers['If-Modified-Since'] = snap.last_modified
+    return headers
+
+  def _accept(self, snap, r):
+    '''The snapshot after response r to a fetch sent with _headers(snap)'''
+    now = time.time()
+    if r.status_code == 304 and snap is not None:
+      with self._lock:
+        snap.fetched_at = now
+        self._stats['not_modified'] += 1
+      return snap
+    if r.status_code != 200:
+      self._bad_status(r.status_code)
+    with probe.stage('decode'):
+      data = r.json()
+    probe.count('feed_refreshes')
+    new = Snapshot(
+      data,
+      etag=r.headers.get('ETag'),
+      last_modified=r.headers.get('Last-Modified'),
+      fetched_at=now,
+      version=(snap.version + 1) if snap else 1
+    )
+    with self._lock:
+      self.snapshot = new
+      self._derived = {}
+      self._stats['refreshes'] += 1
+    return new
+
+  def _bad_status(self, status):
+    raise IOError(
+      '%s returned %s' % (self.url, status)
+    )
+
+  def _memo(self, name, snap, build):
+    with self._lock:
+      hit = self._derived.get(name)
+    if hit is not None and hit[0] == snap.version:
+      return hit[1]
+    value = build(snap.data)
+    with self._lock:
+      if self.snapshot is snap:
+        self._derived[name] = (snap.version, value)
+    return value
+
+
+class FeedCache(SnapshotStore):
+  '''TTL cache for a JSON feed.
+
+  `fetch(url, headers)` must return a requests-style response (status_code, headers, json()). `ttl` is in seconds and can be changed at any time.
+  '''
+  def __init__(self, url, fetch, ttl=30):
+    SnapshotStore.__init__(self, ttl)
+    self.url = url
+    self.fetch = fetch
+    self._flight = None
+
+  def get(self, max_age=None):
+    '''Return a Snapshot no older than max_age (default: ttl) seconds'''
+    if max_age is None:
+      max_age = self.ttl
+    with self._lock:
+      snap = self.snapshot
+      if snap is not None and snap.age() <= max_age:
+        self._stats['hits'] += 1
+        return snap
+      flight = self._flight
+      if flight is None:
+        self._stats['misses'] += 1
+        flight = self._flight = _Flight()
+        leader = True
+      else:
+        self._stats['shared'] += 1
+        leader = False
+    if not leader:
+      flight.done.wait()
+      if flight.error is not None:
+        raise flight.error
+      return flight.snapshot
+    try:
+      flight.snapshot = self._refresh(snap)
+    except Exception as e:
+      flight.error = e
+      self._count('errors')
+      raise
+    finally:
+      with self._lock:
+        self._flight = None
+      flight.done.set()
+    return flight.snapshot
+
+  def _refresh(self, snap):
+    headers = self._headers(snap)
+    with probe.stage('fetch'):
+      r = self.fetch(self.url, headers)
+    return self._accept(snap, r)
+
+  def derive(self, name, build, max_age=None):
+    '''build(data) memoized per snapshot version, e.g. an index over the stations'''
+    return self._memo(name, self.get(max_age), build)
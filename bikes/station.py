@@ -0,0 +1,103 @@
+'''
+Normalized BikePoint records.
+'''
+import datetime
+
+# additionalProperties key -> Station attribute
+COUNTS = {
+  'NbBikes': 'bikes',
+  'NbEmptyDocks': 'spaces',
+  'NbDocks': 'docks',
+}
+FLAGS = {
+  'Locked': 'locked',
+  'Installed': 'installed',
+  'Temporary': 'temporary',
+}
+
+_times = {}
+
+def parse_time(s):
+  '''Parse the feed's ISO timestamps ('2019-02-08T22:20:44.637Z'). Most properties of a snapshot share a handful of values, so parses are memoized.'''
+  if not s:
+    return None
+  t = _times.get(s)
+  if t is None:
+    fmt = '%Y-%m-%dT%H:%M:%S.%fZ' if '.' in s else '%Y-%m-%dT%H:%M:%SZ'
+    try:
+      t = datetime.datetime.strptime(s, fmt)
+    except ValueError:
+      return None
+    if len(_times) > 10000:
+      _times.clear()
+    _times[s] = t
+  return t
+
+
+class Station(object):
+  __slots__ = (
+    'id', 'name', 'lat', 'lon',
+    'bikes', 'spaces', 'docks',
+    'locked', 'installed', 'temporary',
+    'modified',
+  )
+
+  def __init__(self, id, name, lat, lon, bikes=0, spaces=0, docks=0, locked=False, installed=True, temporary=False, modified=None):
+    self.id = id
+    self.name = name
+    self.lat = lat
+    self.lon = lon
+    self.bikes = bikes
+    self.spaces = spaces
+    self.docks = docks
+    self.locked = locked
+    self.installed = installed
+    self.temporary = temporary
+    self.modified = modified
+
+  def __repr__(self):
+    return 'Station(%r, %r, bikes=%s, spaces=%s)' % (
+      self.id, self.name, self.bikes, self.spaces
+    )
+
+  @classmethod
+  def from_record(cls, record):
+    '''Convert a raw /BikePoint or /Place record. `modified` is the newest timestamp among the counts.'''
+    s = cls(
+      record.get('id'),
+      record.get('commonName'),
+      record.get('lat'),
+      record.get('lon')
+    )
+    modified = None
+    for prop in record.get('additionalProperties') or ():
+      k = prop['key']
+      if k in COUNTS:
+        try:
+          setattr(s, COUNTS[k], int(prop['value']))
+        except ValueError:
+          pass
+        t = parse_time(prop.get('modified'))
+        if t is not None and (modified is None or t > modified):
+          modified = t
+      elif k in FLAGS:
+        setattr(s, FLAGS[k], prop['value'] == 'true')
+    s.modified = modified
+    return s
+
+  def count(self, looking_for):
+    '''A count by feed key ('NbBikes') or attribute name ('bikes')'''
+    return getattr(self, COUNTS.get(looking_for, looking_for))
+
+
+def bikes_and_spaces(record):
+  '''(bikes, spaces) from a /Place record, or None if it carries no availability'''
+  if record.get('additionalProperties') is None:
+    return None
+  st = Station.from_record(record)
+  return st.bikes, st.spaces
+
+
+def normalize(data):
+  '''List of Stations from raw BikePoint records'''
+  return [Station.from_record(r) for r in data]
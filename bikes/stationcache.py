@@ -0,0 +1,117 @@
+'''
+On-disk copy of the normalized stations, so the widget can draw before the network answers.
+
+Two files:
+
+  stations.meta    ids, names and coordinates in the mmap-able metastore format; only rewritten when the network itself changes
+  stations.counts  a struct header, then bikes/spaces/docks, timestamps and flags as flat arrays in the same (id) order; rewritten after refreshes
+
+The counts header carries the crc of the meta file it lines up with, so a stale pair is ignored rather than misread. Writes go to a temp file and are renamed into place.
+'''
+from array import array
+import calendar
+import datetime
+import os
+import struct
+import time
+
+from station import Station
+import metastore
+
+VERSION = 1
+META = 'stations.meta'
+COUNTS = 'stations.counts'
+
+# magic, version, station count, crc of the meta payload, saved at
+_COUNTS_HEADER = struct.Struct('<4sHIId')
+
+LOCKED, INSTALLED, TEMPORARY = 1, 2, 4
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _timestamp(t):
+  if t is None:
+    return 0.0
+  return calendar.timegm(t.timetuple()) + t.microsecond / 1e6
+
+
+def pack_counts(stations):
+  counts = array('i')
+  flags = array('B')
+  modified = array('d')
+  for s in stations:
+    counts.extend((s.bikes, s.spaces, s.docks))
+    flags.append(
+      (LOCKED if s.locked else 0)
+      | (INSTALLED if s.installed else 0)
+      | (TEMPORARY if s.temporary else 0)
+    )
+    modified.append(_timestamp(s.modified))
+  return counts.tobytes() + modified.tobytes() + flags.tobytes()
+
+
+def save(stations, directory):
+  '''Write the stations atomically, skipping the meta file when it hasn't changed'''
+  stations = sorted(
+    stations,
+    key=lambda s: s.id.encode('utf-8')
+  )
+  n = len(stations)
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+  meta = metastore.pack(
+    (s.id, s.name, s.lat, s.lon) for s in stations
+  )
+  crc = metastore.HEADER.unpack_from(meta)[-1]
+  meta_path = os.path.join(directory, META)
+  if metastore.read_crc(meta_path) != crc:
+    metastore.write_atomic(meta_path, meta)
+  metastore.write_atomic(
+    os.path.join(directory, COUNTS),
+    _COUNTS_HEADER.pack(
+      b'BKC1', VERSION, n, crc,
+      time.time()
+    ) + pack_counts(stations)
+  )
+
+
+def load(directory):
+  '''Stations from the cache, or None if it's missing, from another version or out of step. Counts come back zeroed if only the meta file is usable.'''
+  try:
+    with metastore.MetaStore(
+        os.path.join(directory, META),
+        verify=True
+      ) as meta:
+      crc = meta.crc
+      stations = [
+        Station(sid, name, lat, lon)
+        for sid, name, lat, lon in meta
+      ]
+  except (IOError, OSError, ValueError):
+    return None
+  n = len(stations)
+  try:
+    with open(os.path.join(directory, COUNTS), 'rb') as f:
+      data = f.read()
+  except (IOError, OSError):
+    return stations
+  size = _COUNTS_HEADER.size
+  if len(data) != size + n * (12 + 8 + 1):
+    return stations
+  magic, version, m, meta_crc, saved_at = _COUNTS_HEADER.unpack_from(data)
+  if magic != b'BKC1' or version != VERSION or m != n or meta_crc != crc:
+    return stations
+  counts = array('i')
+  counts.frombytes(data[size:size + 12 * n])
+  modified = array('d')
+  modified.frombytes(data[size + 12 * n:size + 20 * n])
+  flags = data[size + 20 * n:]
+  for i, s in enumerate(stations):
+    s.bikes, s.spaces, s.docks = counts[3 * i:3 * i + 3]
+    f = flags[i]
+    s.locked = bool(f & LOCKED)
+    s.installed = bool(f & INSTALLED)
+    s.temporary = bool(f & TEMPORARY)
+    if modified[i]:
+      s.modified = _EPOCH + datetime.timedelta(seconds=modified[i])
+  return stations
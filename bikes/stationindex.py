@@ -0,0 +1,229 @@
+'''
+A uniform lat/lon grid over the stations for proximity queries.
+'''
+from math import cos, asin, sqrt, floor, radians
+import heapq
+import json
+
+from station import Station, normalize
+
+EARTH_DIAMETER = 12742000 # metres, same as bikes.distance
+M_PER_DEG = EARTH_DIAMETER * 3.141592653589793 / 360
+
+
+def haversine(lat1, lon1, lat2, lon2):
+  '''Great-circle distance between two points, in metres'''
+  p = 0.017453292519943295     #Pi/180
+  a = 0.5 - cos((lat2 - lat1) * p)/2 + cos(lat1 * p) * cos(lat2 * p) * (1 - cos((lon2 - lon1) * p)) / 2
+  return EARTH_DIAMETER * asin(sqrt(a))
+
+
+class StationIndex(object):
+  '''Buckets stations into square cells of `cell` degrees.
+
+  Items are Stations, whichever constructor built the index; the queries only need their coordinates, but nearby() and the callers taking index= read their id, name and counts.
+  '''
+  def __init__(self, cell=0.005):
+    self.cell = cell
+    self.cells = {}
+    self.count = 0
+    self.max_abs_lat = 0.0
+    self.bounds = None # (min_row, min_col, max_row, max_col)
+
+  def __len__(self):
+    return self.count
+
+  def _key(self, lat, lon):
+    return (
+      int(floor(lat / self.cell)),
+      int(floor(lon / self.cell))
+    )
+
+  def add(self, lat, lon, item):
+    key = self._key(lat, lon)
+    self.cells.setdefault(key, []).append(
+      (lat, lon, item)
+    )
+    self.count += 1
+    self.max_abs_lat = max(self.max_abs_lat, abs(lat))
+    r, c = key
+    if self.bounds is None:
+      self.bounds = (r, c, r, c)
+    else:
+      r0, c0, r1, c1 = self.bounds
+      self.bounds = (
+        min(r0, r), min(c0, c),
+        max(r1, r), max(c1, c)
+      )
+
+  @classmethod
+  def from_bike_data(cls, data, cell=0.005):
+    '''Index raw BikePoint records, as yielded by bikes.get_bike_data()'''
+    return cls.from_stations(normalize(data), cell)
+
+  @classmethod
+  def from_stations(cls, stations, cell=0.005):
+    '''Index normalized Station objects'''
+    index = cls(cell)
+    for station in stations:
+      index.add(station.lat, station.lon, station)
+    return index
+
+  @classmethod
+  def from_simple(cls, stations, cell=0.005):
+    '''Index the name -> (id, lat, lon) mapping written by bikes.write_simple_file(). The file has no availability, so the Stations' counts are all zero.'''
+    index = cls(cell)
+    for name, (sid, lat, lon) in stations.items():
+      index.add(lat, lon, Station(sid, name, lat, lon))
+    return index
+
+  @classmethod
+  def load(cls, path='bikes.json', cell=0.005):
+    with open(path) as f:
+      return cls.from_simple(json.load(f), cell)
+
+  def _cells_in(self, lat0, lon0, lat1, lon1):
+    if self.bounds is None:
+      return
+    r0, c0 = self._key(lat0, lon0)
+    r1, c1 = self._key(lat1, lon1)
+    # a zoomed-out map can span far more cells than the network covers
+    br0, bc0, br1, bc1 = self.bounds
+    r0, c0 = max(r0, br0), max(c0, bc0)
+    r1, c1 = min(r1, br1), min(c1, bc1)
+    cells = self.cells
+    for r in range(r0, r1 + 1):
+      for c in range(c0, c1 + 1):
+        bucket = cells.get((r, c))
+        if bucket:
+          yield bucket
+
+  def box(self, lat, lon, dist):
+    '''Items within `dist` degrees of lat and lon (the same square the isclose() scans used)'''
+    found = []
+    for bucket in self._cells_in(
+        lat - dist, lon - dist,
+        lat + dist, lon + dist
+      ):
+      for la, lo, item in bucket:
+        if abs(la - lat) <= dist and abs(lo - lon) <= dist:
+          found.append(item)
+    return found
+
+  def bbox(self, lat0, lon0, lat1, lon1):
+    '''Items inside the rectangle from (lat0, lon0) to (lat1, lon1), e.g. the visible part of a map'''
+    found = []
+    for bucket in self._cells_in(lat0, lon0, lat1, lon1):
+      for la, lo, item in bucket:
+        if lat0 <= la <= lat1 and lon0 <= lo <= lon1:
+          found.append(item)
+    return found
+
+  def within(self, lat, lon, radius_m):
+    '''(distance in metres, item) pairs within radius_m, closest first'''
+    dlat = radius_m / M_PER_DEG
+    coslat = max(cos(radians(min(abs(lat) + dlat, 89.9))), 1e-6)
+    dlon = dlat / coslat
+    found = []
+    for bucket in self._cells_in(
+        lat - dlat, lon - dlon,
+        lat + dlat, lon + dlon
+      ):
+      for la, lo, item in bucket:
+        d = haversine(lat, lon, la, lo)
+        if d <= radius_m:
+          found.append((d, item))
+    found.sort(key=lambda p: p[0])
+    return found
+
+  def _ring(self, row, col, r):
+    '''Buckets on the square ring r cells away from (row, col), only where it overlaps the network'''
+    cells = self.cells
+    b0, c0, b1, c1 = self.bounds
+    if r == 0:
+      keys = [(row, col)]
+    else:
+      lo, hi = max(col - r, c0), min(col + r, c1)
+      keys = []
+      for edge in (row - r, row + r):
+        if b0 <= edge <= b1:
+          keys += [(edge, c) for c in range(lo, hi + 1)]
+      lo, hi = max(row - r + 1, b0), min(row + r - 1, b1)
+      for edge in (col - r, col + r):
+        if c0 <= edge <= c1:
+          keys += [(rr, edge) for rr in range(lo, hi + 1)]
+    for key in keys:
+      bucket = cells.get(key)
+      if bucket:
+        yield bucket
+
+  def iter_nearest(self, lat, lon, max_distance=None):
+    '''Yield (distance in metres, item) pairs in order of distance, visiting cells ring by ring so a caller that stops early never touches the far side of the network. With max_distance (metres) the scan stops at the last ring that can hold anything that close.'''
+    if not self.count:
+      return
+    row, col = self._key(lat, lon)
+    r0, c0, r1, c1 = self.bounds
+    last = max(
+      abs(row - r0), abs(row - r1),
+      abs(col - c0), abs(col - c1)
+    )
+    # rings closer in than this lie entirely outside the network
+    first = max(r0 - row, row - r1, c0 - col, col - c1, 0)
+    # Anything in ring r+1 is at least r whole cells away in lat or lon.
+    step = self.cell * M_PER_DEG * cos(
+      radians(min(self.max_abs_lat + self.cell, 89.9))
+    )
+    heap = []
+    n = 0
+    for r in range(first, last + 1):
+      if max_distance is not None and (r - 1) * step > max_distance:
+        break
+      for bucket in self._ring(row, col, r):
+        for la, lo, item in bucket:
+          n += 1
+          heapq.heappush(
+            heap,
+            (haversine(lat, lon, la, lo), n, item)
+          )
+      bound = r * step
+      while heap and heap[0][0] <= bound:
+        d, _, item = heapq.heappop(heap)
+        if max_distance is not None and d > max_distance:
+          return
+        yield d, item
+    while heap:
+      d, _, item = heapq.heappop(heap)
+      if max_distance is not None and d > max_distance:
+        return
+      yield d, item
+
+  def nearby(self, lat, lon, dist, looking_for):
+    '''Stations within `dist` degrees that have some of looking_for, as find_nearby_stations returns them: closest first, distance in whole metres'''
+    stations = []
+    for station in self.box(lat, lon, dist):
+      v = station.count(looking_for)
+      if v == 0:
+        continue
+      stations.append(
+        {
+          'name': station.name,
+          'distance': int(haversine(
+            lat, lon,
+            station.lat, station.lon
+          )),
+          looking_for: v,
+        }
+      )
+    return sorted(
+      stations,
+      key=lambda k: k['distance']
+    )
+
+  def nearest(self, lat, lon, k=1):
+    '''The k closest (distance in metres, item) pairs'''
+    found = []
+    for pair in self.iter_nearest(lat, lon):
+      found.append(pair)
+      if len(found) >= k:
+        break
+    return found
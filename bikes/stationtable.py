@@ -0,0 +1,211 @@
+'''
+Column store of the stations for vectorized distance and availability queries.
+
+Uses numpy when it's there and falls back to array('d') and plain loops when it isn't.
+'''
+from array import array
+import heapq
+from math import cos, asin, sqrt, radians
+from station import COUNTS, normalize
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+EARTH_DIAMETER = 12742000 # metres
+
+
+class StationTable(object):
+  def __init__(self, ids, names, lat, lon, bikes, spaces, docks):
+    self.ids = list(ids)
+    self.names = list(names)
+    if np is not None:
+      self.lat = np.asarray(lat, dtype=np.float64)
+      self.lon = np.asarray(lon, dtype=np.float64)
+      self.bikes = np.asarray(bikes, dtype=np.int32)
+      self.spaces = np.asarray(spaces, dtype=np.int32)
+      self.docks = np.asarray(docks, dtype=np.int32)
+      self._rlat = np.radians(self.lat)
+      self._rlon = np.radians(self.lon)
+      self._coslat = np.cos(self._rlat)
+    else:
+      self.lat = array('d', lat)
+      self.lon = array('d', lon)
+      self.bikes = array('i', bikes)
+      self.spaces = array('i', spaces)
+      self.docks = array('i', docks)
+      self._rlat = array('d', map(radians, self.lat))
+      self._rlon = array('d', map(radians, self.lon))
+      self._coslat = array('d', map(cos, self._rlat))
+    self.row = {sid: i for i, sid in enumerate(self.ids)}
+
+  def __len__(self):
+    return len(self.ids)
+
+  @classmethod
+  def from_stations(cls, stations):
+    '''Build from normalized Station objects'''
+    stations = list(stations)
+    return cls(
+      [s.id for s in stations],
+      [s.name for s in stations],
+      [s.lat for s in stations],
+      [s.lon for s in stations],
+      [s.bikes for s in stations],
+      [s.spaces for s in stations],
+      [s.docks for s in stations]
+    )
+
+  @classmethod
+  def from_bike_data(cls, data):
+    '''Build from raw BikePoint records'''
+    return cls.from_stations(normalize(data))
+
+  def column(self, looking_for):
+    '''The count column for a feed key ('NbBikes') or a column name ('bikes')'''
+    return getattr(self, COUNTS.get(looking_for, looking_for))
+
+  def distances(self, lat, lon):
+    '''Metres from (lat, lon) to every station, in row order'''
+    rlat, rlon = radians(lat), radians(lon)
+    c = cos(rlat)
+    if np is not None:
+      a = (
+        0.5 - np.cos(self._rlat - rlat) / 2
+        + c * self._coslat * (1 - np.cos(self._rlon - rlon)) / 2
+      )
+      return EARTH_DIAMETER * np.arcsin(np.sqrt(a))
+    out = array('d', bytes(8 * len(self.ids)))
+    for i, (la, lo, cl) in enumerate(
+        zip(self._rlat, self._rlon, self._coslat)
+      ):
+      a = 0.5 - cos(la - rlat) / 2 + c * cl * (1 - cos(lo - rlon)) / 2
+      out[i] = EARTH_DIAMETER * asin(sqrt(max(a, 0.0)))
+    return out
+
+  def distances_many(self, lats, lons):
+    '''Metres from each query point to every station, one row per query point'''
+    if np is None:
+      return [self.distances(la, lo) for la, lo in zip(lats, lons)]
+    rlat = np.radians(np.asarray(lats, dtype=np.float64))[:, None]
+    rlon = np.radians(np.asarray(lons, dtype=np.float64))[:, None]
+    a = (
+      0.5 - np.cos(self._rlat - rlat) / 2
+      + np.cos(rlat) * self._coslat * (1 - np.cos(self._rlon - rlon)) / 2
+    )
+    return EARTH_DIAMETER * np.arcsin(np.sqrt(a))
+
+  def rows_with(self, looking_for, at_least=1):
+    '''Row numbers of stations with at least `at_least` of looking_for'''
+    col = self.column(looking_for)
+    if np is not None:
+      return np.flatnonzero(col >= at_least)
+    return [i for i, v in enumerate(col) if v >= at_least]
+
+  def nearest(self, lat, lon, k=5, looking_for='NbBikes', at_least=1, max_distance=None):
+    '''The k closest stations with at least `at_least` of looking_for, in the same shape find_nearby_stations returns'''
+    d = self.distances(lat, lon)
+    rows = self.rows_with(looking_for, at_least)
+    col = self.column(looking_for)
+    if np is not None:
+      dd = d[rows]
+      if max_distance is not None:
+        keep = dd <= max_distance
+        rows, dd = rows[keep], dd[keep]
+      if len(rows) > k:
+        part = np.argpartition(dd, k)[:k]
+        rows, dd = rows[part], dd[part]
+      order = np.argsort(dd, kind='stable')
+      picked = [(dd[j], rows[j]) for j in order]
+    else:
+      picked = sorted((d[i], i) for i in rows)
+      if max_distance is not None:
+        picked = [p for p in picked if p[0] <= max_distance]
+      picked = picked[:k]
+    return [
+      {
+        'id': self.ids[i],
+        'name': self.names[i],
+        'distance': int(dist),
+        looking_for: int(col[i]),
+      }
+      for dist, i in picked
+    ]
+
+  def nearest_rows_many(self, lats, lons, k=5, looking_for='NbBikes', at_least=1, max_distance=None, chunk=256):
+    '''For each query point, the rows of its k closest stations with at least `at_least` of looking_for, and their distances in metres, closest first: two (points x k) arrays (lists of lists without numpy). Slots with no station left, or only ones past max_distance, hold row -1 and distance inf.
+
+    Only the qualifying stations are considered, they're ranked by a flat-earth approximation (fine at city scale) before the closest few get a proper haversine, and the query points go through in chunks of `chunk` so the working matrices stay small however many points there are.'''
+    cand = self.rows_with(looking_for, at_least)
+    if np is None:
+      rows, dist = [], []
+      for la, lo in zip(lats, lons):
+        d = self.distances(la, lo)
+        picked = heapq.nsmallest(k, ((d[i], i) for i in cand))
+        if max_distance is not None:
+          picked = [p for p in picked if p[0] <= max_distance]
+        pad = k - len(picked)
+        rows.append([i for _, i in picked] + [-1] * pad)
+        dist.append([dd for dd, _ in picked] + [float('inf')] * pad)
+      return rows, dist
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    n, m = len(lats), len(cand)
+    rows = np.full((n, k), -1, dtype=np.intp)
+    dist = np.full((n, k), np.inf)
+    kk = min(k, m)
+    if kk == 0:
+      return rows, dist
+    # rank on the flat-earth approximation first, which needs no trig per station, then measure only the best few properly
+    short = min(m, 2 * kk + 2)
+    slat, slon, scos = self._rlat[cand], self._rlon[cand], self._coslat[cand]
+    for start in range(0, n, chunk):
+      rlat = np.radians(lats[start:start + chunk])[:, None]
+      rlon = np.radians(lons[start:start + chunk])[:, None]
+      dy = slat - rlat
+      dx = (slon - rlon) * np.cos(rlat)
+      flat = dx * dx + dy * dy
+      if short < m:
+        part = np.argpartition(flat, short - 1, axis=1)[:, :short]
+      else:
+        part = np.tile(np.arange(m), (len(flat), 1))
+      plat = slat[part]
+      a = (
+        0.5 - np.cos(plat - rlat) / 2
+        + np.cos(rlat) * scos[part] * (1 - np.cos(slon[part] - rlon)) / 2
+      )
+      pd = EARTH_DIAMETER * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+      order = np.argsort(pd, axis=1, kind='stable')[:, :kk]
+      part = np.take_along_axis(part, order, axis=1)
+      pd = np.take_along_axis(pd, order, axis=1)
+      r = cand[part]
+      if max_distance is not None:
+        far = pd > max_distance
+        r[far] = -1
+        pd[far] = np.inf
+      rows[start:start + len(pd), :kk] = r
+      dist[start:start + len(pd), :kk] = pd
+    return rows, dist
+
+  def nearest_many(self, lats, lons, k=5, looking_for='NbBikes', at_least=1, max_distance=None):
+    '''nearest() for many query points against the same snapshot: one list of find_nearby_stations-shaped dicts per point'''
+    rows, dist = self.nearest_rows_many(
+      lats, lons, k, looking_for, at_least, max_distance
+    )
+    if np is not None:
+      rows, dist = rows.tolist(), dist.tolist()
+    col = self.column(looking_for)
+    return [
+      [
+        {
+          'id': self.ids[i],
+          'name': self.names[i],
+          'distance': int(dd),
+          looking_for: int(col[i]),
+        }
+        for i, dd in zip(r, ds)
+        if i >= 0
+      ]
+      for r, ds in zip(rows, dist)
+    ]
@@ -0,0 +1,49 @@
+'''
+bench's percentile and network scaling.
+'''
+import json
+import os
+import unittest
+
+try:
+  import bench
+except ImportError:
+  # bench imports bikes, which needs Pythonista's ui and appex
+  bench = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+@unittest.skipIf(bench is None, 'bikes only imports in Pythonista')
+class PercentileTest(unittest.TestCase):
+  def test_nearest_rank(self):
+    self.assertEqual(bench.percentile([1, 2], 50), 1)
+    self.assertEqual(bench.percentile([1, 2, 3, 4], 50), 2)
+    self.assertEqual(bench.percentile([1, 2, 3, 4], 75), 3)
+    self.assertEqual(bench.percentile(list(range(1, 101)), 99), 99)
+    self.assertEqual(bench.percentile([5], 99), 5)
+    self.assertEqual(bench.percentile([1, 2, 3], 0), 1)
+    self.assertIsNone(bench.percentile([], 50))
+
+
+@unittest.skipIf(bench is None, 'bikes only imports in Pythonista')
+class ScaleNetworkTest(unittest.TestCase):
+  def test_density_stays_the_same(self):
+    from stationindex import StationIndex
+    with open(os.path.join(HERE, 'data.json')) as f:
+      records = json.load(f)
+    base = StationIndex.from_bike_data(records)
+    big = StationIndex.from_bike_data(
+      bench.scale_network(records, 10 * len(records))
+    )
+    self.assertEqual(len(big), 10 * len(records))
+    per_cell = len(base) / float(len(base.cells))
+    self.assertAlmostEqual(len(big) / float(len(big.cells)), per_cell, delta=0.2)
+    self.assertLessEqual(
+      max(len(b) for b in big.cells.values()),
+      2 * max(len(b) for b in base.cells.values())
+    )
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,50 @@
+'''
+feedstream.iter_array and iter_stations over chunked input.
+'''
+import json
+import os
+import unittest
+
+from feedstream import iter_array, iter_stations
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data.json')
+
+
+class IterArrayTest(unittest.TestCase):
+  def test_number_split_across_chunks(self):
+    self.assertEqual(list(iter_array([b'[1, 23', b'4, 5]'])), [1, 234, 5])
+
+  def test_number_split_by_empty_chunk(self):
+    self.assertEqual(list(iter_array([b'[1, 23', b'', b'4]'])), [1, 234])
+
+  def test_multibyte_character_split_across_chunks(self):
+    body = u'["café"]'.encode('utf-8')
+    self.assertEqual(list(iter_array([body[:5], body[5:]])), [u'café'])
+
+  def test_truncated_array(self):
+    with self.assertRaises(ValueError):
+      list(iter_array([b'[{"a": 1}, {"b"']))
+
+  def test_not_an_array(self):
+    with self.assertRaises(ValueError):
+      list(iter_array([b'{"a": 1}']))
+
+  def test_recorded_feed_in_any_chunk_size(self):
+    with open(DATA, 'rb') as f:
+      body = f.read()
+    expected = json.loads(body.decode('utf-8'))
+    for size in (13, 4096):
+      chunks = [body[i:i + size] for i in range(0, len(body), size)]
+      self.assertEqual(list(iter_array(chunks)), expected)
+
+  def test_stations(self):
+    body = json.dumps([{
+      'id': 'BikePoints_1', 'commonName': 'A', 'lat': 51.5, 'lon': -0.1,
+      'additionalProperties': [{'key': 'NbBikes', 'value': '4'}],
+    }]).encode('utf-8')
+    st, = iter_stations([body[:20], body[20:]])
+    self.assertEqual((st.id, st.bikes), ('BikePoints_1', 4))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,55 @@
+'''
+LocationProvider against StaticBackend and a backend that never gets a fix.
+'''
+import unittest
+
+from locator import Fix, LocationProvider, StaticBackend
+
+
+class NoFixBackend(object):
+  def __init__(self):
+    self.calls = 0
+
+  def fix(self):
+    self.calls += 1
+    return None
+
+
+class LocationProviderTest(unittest.TestCase):
+  def test_reuses_a_recent_fix(self):
+    backend = StaticBackend(51.5, -0.1)
+    locator = LocationProvider(backend, max_age=30)
+    first = locator.get()
+    self.assertEqual((first.lat, first.lon), (51.5, -0.1))
+    self.assertIs(locator.get(), first)
+    self.assertEqual(backend.calls, 1)
+    self.assertEqual(locator.stats(), {'hits': 1, 'fixes': 1})
+
+  def test_stale_fix_asks_again(self):
+    backend = StaticBackend(51.5, -0.1)
+    locator = LocationProvider(backend)
+    locator.get()
+    locator.get(max_age=-1)
+    self.assertEqual(backend.calls, 2)
+
+  def test_inaccurate_fix_is_not_reused(self):
+    backend = StaticBackend(51.5, -0.1, accuracy=500.0)
+    locator = LocationProvider(backend, min_accuracy=50)
+    locator.get()
+    locator.get()
+    self.assertEqual(backend.calls, 2)
+
+  def test_none_without_any_fix(self):
+    locator = LocationProvider(NoFixBackend())
+    self.assertIsNone(locator.get())
+
+  def test_old_fix_beats_none(self):
+    backend = NoFixBackend()
+    locator = LocationProvider(backend)
+    locator.last = Fix(51.5, -0.1, timestamp=0)
+    self.assertIs(locator.get(), locator.last)
+    self.assertEqual(backend.calls, 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,208 @@
+'''
+PinBuilder, ViewPool and PinMixin against a fake Objective-C bridge, so the pin bookkeeping runs off the device.
+'''
+import unittest
+
+from pins import PinBuilder, PinMixin, ViewPool, address, state_for
+
+
+class FakeObject(object):
+  '''Stands in for an ObjCInstance: records what was set on it'''
+  def __init__(self, cls):
+    self.cls = cls
+    self.attrs = {}
+
+  def init(self):
+    return self
+
+  def autorelease(self):
+    return self
+
+  def setTitle_(self, title):
+    self.attrs['title'] = title
+
+  def setSubtitle_(self, subtitle):
+    self.attrs['subtitle'] = subtitle
+
+  def setCoordinate_(self, coordinate, restype=None, argtypes=None):
+    self.attrs['coordinate'] = coordinate
+
+  def initWithAnnotation_reuseIdentifier_(self, annotation, ident):
+    self.attrs['annotation'] = annotation
+    self.attrs['identifier'] = ident
+    return self
+
+  def setAnnotation_(self, annotation):
+    self.attrs['annotation'] = annotation
+
+  def setMarkerTintColor_(self, color):
+    self.attrs['tint'] = color
+
+
+class FakeClass(object):
+  def __init__(self, name):
+    self.name = name
+
+  def alloc(self):
+    return FakeObject(self.name)
+
+  def __getattr__(self, name):
+    # UIColor.systemRedColor() and friends
+    if name.startswith('system'):
+      return lambda: name
+    raise AttributeError(name)
+
+
+class FakeBridge(object):
+  '''objc_class for PinBuilder and ViewPool, counting class lookups'''
+  def __init__(self):
+    self.lookups = []
+
+  def __call__(self, name):
+    self.lookups.append(name)
+    return FakeClass(name)
+
+
+def coordinate(lat, lon):
+  return (lat, lon)
+
+
+class FakeMap(object):
+  '''The parts of MKMapView the pin code calls'''
+  def __init__(self):
+    self.annotations_ = []
+    self.batches = 0
+    self.spare = {}
+    self.on_screen = {}
+
+  def addAnnotations_(self, annotations):
+    self.batches += 1
+    self.annotations_.extend(annotations)
+
+  def removeAnnotations_(self, annotations):
+    gone = set(id(a) for a in annotations)
+    self.annotations_ = [a for a in self.annotations_ if id(a) not in gone]
+
+  def annotations(self):
+    return list(self.annotations_)
+
+  def dequeueReusableAnnotationViewWithIdentifier_(self, ident):
+    views = self.spare.get(ident)
+    return views.pop() if views else None
+
+  def viewForAnnotation_(self, annotation):
+    return self.on_screen.get(id(annotation))
+
+
+class FakeMapView(PinMixin):
+  pin_builder = PinBuilder(FakeBridge(), coordinate)
+
+  def __init__(self):
+    self._init_pins()
+    self.mk_map_view = FakeMap()
+
+
+class FakeViewport(object):
+  def __init__(self):
+    self.resets = 0
+
+  def reset(self):
+    self.resets += 1
+
+
+class PinBuilderTest(unittest.TestCase):
+  def test_build_looks_up_classes_once(self):
+    bridge = FakeBridge()
+    builder = PinBuilder(bridge, coordinate)
+    annotations = builder.build([
+      (51.5, -0.1, '3/10'),
+      (51.6, -0.2, '0/10', 'Strand', 'empty'),
+    ])
+    self.assertEqual(bridge.lookups, ['MKPointAnnotation'])
+    self.assertEqual(annotations[0].attrs, {
+      'title': '3/10', 'coordinate': (51.5, -0.1)
+    })
+    self.assertEqual(annotations[1].attrs['subtitle'], 'Strand')
+
+  def test_update_in_place(self):
+    builder = PinBuilder(FakeBridge(), coordinate)
+    a = builder.annotation(51.5, -0.1, '3/10', 'Strand')
+    builder.update(a, 51.5, -0.1, '4/10')
+    self.assertEqual(a.attrs['title'], '4/10')
+    self.assertEqual(a.attrs['subtitle'], '')
+
+
+class ViewPoolTest(unittest.TestCase):
+  def test_reuses_dequeued_views(self):
+    pool = ViewPool(FakeBridge())
+    mk = FakeMap()
+    first = pool.view_for(mk, 'a', 'low')
+    self.assertEqual(first.attrs['identifier'], 'BikeMarker.low')
+    self.assertEqual(first.attrs['tint'], 'systemOrangeColor')
+    mk.spare['BikeMarker.low'] = [first]
+    again = pool.view_for(mk, 'b', 'low')
+    self.assertIs(again, first)
+    self.assertEqual(again.attrs['annotation'], 'b')
+    self.assertEqual(pool.stats(), {'hits': 1, 'misses': 1})
+
+  def test_no_view_without_a_state(self):
+    pool = ViewPool(FakeBridge())
+    self.assertIsNone(pool.view_for(FakeMap(), 'user location', None))
+
+
+class PinMixinTest(unittest.TestCase):
+  def setUp(self):
+    self.view = FakeMapView()
+    self.map = self.view.mk_map_view
+
+  def test_add_pins_in_one_batch(self):
+    self.view.add_pins({
+      'a': (51.5, -0.1, '3/10', 'A', 'plenty'),
+      'b': (51.6, -0.2, '0/10', 'B', 'empty'),
+      'c': (51.7, -0.3, 'plain'),
+    })
+    self.assertEqual(self.map.batches, 1)
+    self.assertEqual(len(self.map.annotations()), 3)
+    self.assertEqual(self.view.pin_state(self.view.pins['b']), 'empty')
+    self.assertIsNone(self.view.pin_state(self.view.pins['c']))
+
+  def test_re_adding_a_key_replaces_its_pin(self):
+    self.view.add_pins({'a': (51.5, -0.1, '3/10', 'A', 'plenty')})
+    old = self.view.pins['a']
+    self.view.add_pins({'a': (51.5, -0.1, '0/10', 'A', 'empty')})
+    self.assertEqual(len(self.map.annotations()), 1)
+    self.assertNotIn(address(old), self.view.pin_states)
+
+  def test_update_pins(self):
+    self.view.add_pins({
+      'a': (51.5, -0.1, '3/10', 'A', 'plenty'),
+      'b': (51.6, -0.2, '0/10', 'B', 'empty'),
+    })
+    a = self.view.pins['a']
+    self.view.update_pins({
+      'a': (51.5, -0.1, '1/10', 'A', state_for(1)),
+      'b': None,
+      'c': (51.7, -0.3, '5/10', 'C', 'plenty'),
+    })
+    self.assertIs(self.view.pins['a'], a)
+    self.assertEqual(a.attrs['title'], '1/10')
+    self.assertEqual(self.view.pin_state(a), 'low')
+    self.assertEqual(sorted(self.view.pins), ['a', 'c'])
+    self.assertEqual(len(self.map.annotations()), 2)
+
+  def test_update_pins_without_add(self):
+    self.view.update_pins({'x': (51.5, -0.1, '1/10')}, add=False)
+    self.assertEqual(self.view.pins, {})
+
+  def test_remove_all_pins_resets_the_viewport(self):
+    self.view.viewport = FakeViewport()
+    self.view.add_pins({'a': (51.5, -0.1, '3/10', 'A', 'plenty')})
+    self.view.remove_all_pins()
+    self.assertEqual(self.map.annotations(), [])
+    self.assertEqual(self.view.pins, {})
+    self.assertEqual(self.view.pin_states, {})
+    self.assertEqual(self.view.viewport.resets, 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
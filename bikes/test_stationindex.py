@@ -0,0 +1,91 @@
+'''
+StationIndex queries checked against brute force, and what its constructors store.
+'''
+import json
+import os
+import random
+import time
+import unittest
+
+from station import Station
+from stationindex import StationIndex, haversine
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def random_index(n=500, seed=1):
+  rnd = random.Random(seed)
+  index = StationIndex(cell=0.005)
+  points = []
+  for i in range(n):
+    lat = 51.45 + rnd.random() * 0.12
+    lon = -0.25 + rnd.random() * 0.3
+    index.add(lat, lon, i)
+    points.append((lat, lon, i))
+  return index, points
+
+
+def brute_force(points, lat, lon, max_distance=None):
+  found = sorted(
+    (haversine(lat, lon, la, lo), i) for la, lo, i in points
+  )
+  return [i for d, i in found if max_distance is None or d <= max_distance]
+
+
+class IterNearestTest(unittest.TestCase):
+  def setUp(self):
+    self.index, self.points = random_index()
+
+  def test_matches_brute_force(self):
+    for lat, lon in ((51.5, -0.1), (51.3, -0.5), (51.6, 0.2)):
+      for max_distance in (None, 300, 1000, 5000):
+        got = [
+          i for d, i in self.index.iter_nearest(lat, lon, max_distance)
+        ]
+        self.assertEqual(
+          got, brute_force(self.points, lat, lon, max_distance)
+        )
+
+  def test_far_from_the_network_returns_at_once(self):
+    t = time.time()
+    self.assertEqual(list(self.index.iter_nearest(0.0, 0.0, 1000)), [])
+    self.assertLess(time.time() - t, 1.0)
+
+  def test_nearest_far_away_still_finds_something(self):
+    (d, i), = self.index.nearest(0.0, 0.0)
+    self.assertEqual(i, brute_force(self.points, 0.0, 0.0)[0])
+
+  def test_empty_index(self):
+    self.assertEqual(list(StationIndex().iter_nearest(51.5, -0.1, 1000)), [])
+
+
+class ConstructorTest(unittest.TestCase):
+  def assert_stations(self, index):
+    items = [item for bucket in index.cells.values() for la, lo, item in bucket]
+    self.assertTrue(items)
+    for item in items:
+      self.assertIsInstance(item, Station)
+
+  def test_from_bike_data(self):
+    with open(os.path.join(HERE, 'data.json')) as f:
+      index = StationIndex.from_bike_data(json.load(f))
+    self.assert_stations(index)
+    found = index.nearby(51.51, -0.12, 0.005, 'bikes')
+    self.assertTrue(found)
+    self.assertEqual(set(found[0]), set(['name', 'distance', 'bikes']))
+
+  def test_load(self):
+    index = StationIndex.load(os.path.join(HERE, 'bikes.json'))
+    self.assert_stations(index)
+    st = index.box(51.51, -0.12, 0.004)[0]
+    self.assertTrue(st.id.startswith('BikePoints_'))
+    self.assertEqual(st.count('NbBikes'), 0)
+
+  def test_from_simple(self):
+    index = StationIndex.from_simple({'A': ('BikePoints_1', 51.5, -0.1)})
+    (d, st), = index.nearest(51.5, -0.1)
+    self.assertEqual((st.id, st.name, st.bikes), ('BikePoints_1', 'A', 0))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,71 @@
+'''
+HTTP client for the TfL unified API: one pooled session, gzip, timeouts and retries.
+'''
+import requests
+from requests.adapters import HTTPAdapter
+try:
+  from urllib3.util.retry import Retry
+except ImportError:
+  from requests.packages.urllib3.util.retry import Retry
+
+from instrument import probe
+
+BASE_URL = 'https://api.tfl.gov.uk'
+
+
+class TflClient(object):
+  def __init__(self, base_url=BASE_URL, timeout=(3.05, 10), retries=2, backoff=0.1, pool_size=8):
+    '''timeout is (connect, read) seconds, used when a call doesn't pass its own. Failed requests are retried `retries` times, sleeping backoff, 2*backoff, ... in between.'''
+    self.base_url = base_url.rstrip('/')
+    self.timeout = timeout
+    self.session = requests.Session()
+    self.session.headers.update({
+      'Accept': 'application/json',
+      'Accept-Encoding': 'gzip, deflate',
+      'Cache-Control': 'no-cache',
+    })
+    retry = Retry(
+      total=retries,
+      connect=retries,
+      read=retries,
+      status=retries,
+      backoff_factor=backoff,
+      status_forcelist=(429, 500, 502, 503, 504),
+      raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+      pool_connections=1,
+      pool_maxsize=pool_size,
+      max_retries=retry
+    )
+    self.session.mount('https://', adapter)
+    self.session.mount('http://', adapter)
+
+  def url(self, path):
+    if path.startswith('http://') or path.startswith('https://'):
+      return path
+    return self.base_url + '/' + path.lstrip('/')
+
+  def get(self, path, headers=None, timeout=None, **kwargs):
+    '''GET a path (or absolute url) on the pooled session'''
+    return self.session.get(
+      self.url(path),
+      headers=headers,
+      timeout=self.timeout if timeout is None else timeout,
+      **kwargs
+    )
+
+  def fetch(self, url, headers):
+    '''The fetch(url, headers) hook FeedCache expects'''
+    return self.get(url, headers=headers)
+
+  def place(self, sid, timeout=None):
+    '''Parsed /Place/{sid} record'''
+    with probe.stage('fetch'):
+      r = self.get('/Place/' + sid, timeout=timeout)
+    r.raise_for_status()
+    with probe.stage('decode'):
+      return r.json()
+
+  def close(self):
+    self.session.close()
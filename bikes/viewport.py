@@ -0,0 +1,90 @@
+'''
+Keeps only the pins in the visible region on the map, adding and removing the difference after each pan or zoom.
+'''
+import threading
+
+
+def bounding_box(region, margin=0.0):
+  '''(lat0, lon0, lat1, lon1) of a (lat, lon, d_lat, d_lon) region, grown by `margin` of its span on every side'''
+  lat, lon, d_lat, d_lon = region
+  h = d_lat * (0.5 + margin)
+  w = d_lon * (0.5 + margin)
+  return lat - h, lon - w, lat + h, lon + w
+
+
+class ViewportManager(object):
+  def __init__(self, query, show, hide, delay=0.25, margin=0.1, update=None):
+    '''query(lat0, lon0, lat1, lon1) returns {key: pin} for a bounding box; show({key: pin}) adds pins and hide(keys) removes them (MapView.add_pins and MapView.remove_pins). If update({key: pin}) is given (MapView.update_pins), pins that stay in view but compare unequal to last time are passed to it. delay is the debounce in seconds.'''
+    self.query = query
+    self.show = show
+    self.hide = hide
+    self.delay = delay
+    self.margin = margin
+    self.update = update
+    self.shown = {}
+    self.region = None
+    self._timer = None
+    self._lock = threading.Lock()
+    # serializes refreshes; kept apart from _lock because show/hide wait on the main thread, which calls region_changed
+    self._refreshing = threading.Lock()
+    self._stats = {'refreshes': 0, 'added': 0, 'removed': 0, 'updated': 0, 'debounced': 0}
+
+  def stats(self):
+    with self._lock:
+      s = dict(self._stats)
+    s['shown'] = len(self.shown)
+    return s
+
+  def region_changed(self, region):
+    '''Call after every regionDidChange; only the last region in a burst gets refreshed'''
+    with self._lock:
+      if self._timer is not None:
+        self._timer.cancel()
+        self._stats['debounced'] += 1
+      self._timer = threading.Timer(self.delay, self.refresh, [region])
+      self._timer.daemon = True
+      self._timer.start()
+
+  def cancel(self):
+    with self._lock:
+      if self._timer is not None:
+        self._timer.cancel()
+        self._timer = None
+
+  def refresh(self, region=None):
+    '''Bring the pins in line with region (default: the last one) right away. Call with no region after the data changes, e.g. from an AvailabilityTracker subscription.'''
+    with self._refreshing:
+      with self._lock:
+        if self._timer is threading.current_thread():
+          self._timer = None
+        if region is None:
+          region = self.region
+        if region is None:
+          return
+        self.region = region
+      wanted = self.query(*bounding_box(region, self.margin))
+      shown = self.shown
+      leaving = [k for k in shown if k not in wanted]
+      entering = {k: pin for k, pin in wanted.items() if k not in shown}
+      changed = {}
+      if self.update is not None:
+        changed = {
+          k: pin for k, pin in wanted.items()
+          if k in shown and pin != shown[k]
+        }
+      if leaving:
+        self.hide(leaving)
+      if entering:
+        self.show(entering)
+      if changed:
+        self.update(changed)
+      self.shown = dict(wanted)
+      with self._lock:
+        self._stats['refreshes'] += 1
+        self._stats['added'] += len(entering)
+        self._stats['removed'] += len(leaving)
+        self._stats['updated'] += len(changed)
+
+  def reset(self):
+    '''Forget what's shown, e.g. after the map's pins were cleared some other way'''
+    self.shown = {}